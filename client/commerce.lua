@@ -22,23 +22,37 @@ function axia:StationItems()
     end
 end
 
+-- The inventory last reported for each station id, along with the digest
+-- returned for it by the server
+axia.station_inventories = {}
+
 --[[
 --
--- Sends a report on the current station's items to the server.
--- Does nothing if not in a station.
+-- Sends a report on the current station's items to the server. If they are
+-- unchanged since they were last reported, only their digest is sent, and
+-- the items are sent in full only if the server has a newer inventory.
 --
 --]]
 function axia:StationReport()
     local stationid = GetStationLocation()
 
     if stationid and GetCurrentStationType() == 0 then
+        local items     = axia:StationItems()
+        local inventory = json.encode(items)
+        local last      = axia.station_inventories[stationid]
+
+        if last and last.inventory == inventory then
+            axia:StationDigestReport(stationid, last.digest)
+            return
+        end
+
         local data = axia:LocationData(GetCurrentSectorid())
 
         data['station_id']   = stationid
         data['station_name'] = GetStationName()
         data['faction_id']   = GetStationFaction()
         data['faction_name'] = FactionName[data['faction_id']]
-        data['items']        = axia:StationItems()
+        data['items']        = items
 
         axia:ApiRequest(
             'econ/station_report/',
@@ -46,6 +60,10 @@ function axia:StationReport()
             data,
             --success
             function(data)
+                axia.station_inventories[stationid] = {
+                    inventory = inventory,
+                    digest    = data['digest'],
+                }
                 axia:Log(axia.DATA, 'Commerce report set')
             end,
             --failure
@@ -59,6 +77,55 @@ function axia:StationReport()
     end
 end
 
+--[[
+--
+-- Reports that a station's items are unchanged, by the digest the server
+-- returned when they were last reported. Reports the items in full if the
+-- server has since been sent a different inventory for the station.
+--
+--]]
+function axia:StationDigestReport(stationid, digest)
+    local data = {
+        station_id = stationid,
+        digest     = digest,
+    }
+
+    axia:ApiRequest(
+        'econ/station_report/',
+        'POST',
+        data,
+        --success
+        function(data)
+            axia:Log(axia.DEBUG, 'Commerce report unchanged')
+        end,
+        --failure
+        function(data)
+            if data['stale'] then
+                axia.station_inventories[stationid] = nil
+                axia:StationReport()
+            else
+                local label = data['label']
+                for field, err in pairs(data['errors']) do
+                    axia:Log(axia.ERROR, '%s [%s]: %s', { label, field, err })
+                end
+            end
+        end
+    );
+end
+
+--[[
+--
+-- Logs the failure of an item query, along with the names suggested when the
+-- item was not found.
+--
+--]]
+function axia:LogItemFailure(data)
+    axia:Log(axia.ERROR, data['error'])
+    if data['suggestions'] and #data['suggestions'] > 0 then
+        axia:Log(axia.ERROR, 'Did you mean: %s?', { table.concat(data['suggestions'], ', ') })
+    end
+end
+
 --[[
 --
 -- Requests a list of the nearest locations selling an item.
@@ -74,14 +141,14 @@ function axia:NearestSellLocations(data)
         data,
         --success
         function(data)
-            axia:Log(axia.DATA, 'Closest locations where "%s" is available:', { item })
+            axia:Log(axia.DATA, 'Closest locations where "%s" is available:', { data['item'] })
             for i, loc in ipairs(data['locations']) do
                 axia:Log(axia.DATA, loc)
             end
         end,
         --failure
         function(data)
-            axia:Log(axia.ERROR, data['error'])
+            axia:LogItemFailure(data)
         end
     )
 end
@@ -101,12 +168,109 @@ function axia:CheapestSellLocations(data)
         data,
         --success
         function(data)
-            axia:Log(axia.DATA, 'Cheapest locations where "%s" is available:', { item })
+            axia:Log(axia.DATA, 'Cheapest locations where "%s" is available:', { data['item'] })
             for i, loc in ipairs(data['locations']) do
                 axia:Log(axia.DATA, loc)
             end
         end,
         --failure
+        function(data)
+            axia:LogItemFailure(data)
+        end
+    )
+end
+
+--[[
+--
+-- Requests a list of the cheapest locations selling an item within a number
+-- of jumps of the current system, e.g. "/find_within 3 Xith Ore".
+--
+--]]
+function axia:CheapestSellLocationsWithin(data)
+    local max_jumps = tonumber(table.remove(data, 1))
+    local item      = table.concat(data, ' ')
+
+    if max_jumps == nil then
+        axia:Log(axia.ERROR, 'usage: /find_within <jumps> <item>')
+        return
+    end
+
+    local data = {
+        item      = item,
+        sid       = GetCurrentSystemid(),
+        max_jumps = max_jumps,
+    }
+
+    axia:ApiRequest(
+        'econ/cheapest_items/',
+        'GET',
+        data,
+        --success
+        function(data)
+            axia:Log(axia.DATA, 'Cheapest locations within %d jumps where "%s" is available:', { max_jumps, data['item'] })
+            for i, loc in ipairs(data['locations']) do
+                axia:Log(axia.DATA, loc)
+            end
+        end,
+        --failure
+        function(data)
+            axia:LogItemFailure(data)
+        end
+    )
+end
+
+--[[
+--
+-- Requests a list of the most profitable trade runs, e.g. "/trade_routes 10".
+--
+--]]
+function axia:TradeRoutes(data)
+    local limit = tonumber(data[1] or 6)
+
+    if limit == nil then
+        axia:Log(axia.ERROR, 'usage: /trade_routes [count]')
+        return
+    end
+
+    axia:ApiRequest(
+        'econ/trade_routes/',
+        'GET',
+        { limit = limit },
+        --success
+        function(data)
+            axia:Log(axia.DATA, 'Most profitable trade runs:')
+            for i, route in ipairs(data['routes']) do
+                axia:Log(axia.DATA, route)
+            end
+        end,
+        --failure
+        function(data)
+            axia:Log(axia.ERROR, data['error'])
+        end
+    )
+end
+
+--[[
+--
+-- Requests a list of the item names starting with or most like some text,
+-- e.g. "/items xith".
+--
+--]]
+function axia:ItemNames(data)
+    local text = table.concat(data, ' ')
+
+    axia:ApiRequest(
+        'econ/item_names/',
+        'GET',
+        { text = text },
+        --success
+        function(data)
+            axia:Log(axia.DATA, 'Items matching "%s":', { text })
+            for i, name in ipairs(data['names']) do
+                axia:Log(axia.DATA, name)
+            end
+        end,
+        --failure
         function(data)
             axia:Log(axia.ERROR, data['error'])
         end
@@ -120,3 +284,6 @@ RegisterEvent(axia.StationReport, 'ENTERED_STATION')
 --Register user commands
 RegisterUserCommand('find_nearest', axia.NearestSellLocations)
 RegisterUserCommand('find_cheapest', axia.CheapestSellLocations)
+RegisterUserCommand('find_within', axia.CheapestSellLocationsWithin)
+RegisterUserCommand('trade_routes', axia.TradeRoutes)
+RegisterUserCommand('items', axia.ItemNames)
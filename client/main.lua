@@ -35,6 +35,11 @@ axia.DEBUG = 4
 
 axia.version   = '0.8'
 axia.log_level = axia.INFO
+
+-- Sector reports are sent in batches of this many, or this many seconds
+-- after the first report in a batch
+axia.report_batch_size = 10
+axia.report_interval   = 60
 axia.base_url  = 'http://axia.artfulcode.net/vo/'
 --axia.base_url  = 'http://localhost:8000/vo/'
 
@@ -25,9 +25,13 @@ function axia:LocationData(sector_id)
     }
 end
 
+axia.sector_reports      = {}
+axia.sector_report_timer = nil
+
 --[[
 --
--- On entering a sector with an ion storm, notifies ADS of its presence.
+-- On entering a sector, records whether it has an ion storm or obstacles, to
+-- be reported to ADS with the next batch of sector reports.
 --
 --]]
 function axia:OnEnterSector(event, data)
@@ -37,18 +41,68 @@ function axia:OnEnterSector(event, data)
     local data = axia:LocationData(GetCurrentSectorid())
     data['has_storm']     = has_storm
     data['has_obstacles'] = has_obstacles
+    data['observed']      = os.time()
+
+    table.insert(axia.sector_reports, data)
+
+    if #axia.sector_reports >= axia.report_batch_size then
+        axia:SendSectorReports()
+    elseif axia.sector_report_timer == nil then
+        axia.sector_report_timer = Timer()
+        axia.sector_report_timer:SetTimeout(axia.report_interval * 1000,
+            function()
+                axia:SendSectorReports()
+            end
+        )
+    end
+end
+
+--[[
+--
+-- Sends every sector report recorded since the last batch to ADS in a single
+-- request.
+--
+--]]
+function axia:SendSectorReports()
+    if axia.sector_report_timer ~= nil then
+        axia.sector_report_timer:Kill()
+        axia.sector_report_timer = nil
+    end
+
+    local reports = axia.sector_reports
+    if #reports == 0 then
+        return
+    end
+    axia.sector_reports = {}
+
+    -- Report how long ago each sector was observed, rather than when, so
+    -- that a wrong clock does not matter.
+    local now = os.time()
+    for i, report in ipairs(reports) do
+        report['age'] = os.difftime(now, report['observed'])
+        report['observed'] = nil
+    end
 
-    axia:ApiRequest('nav/sector_report/', 'POST', data,
+    local storms = 0
+    for i, report in ipairs(reports) do
+        if report['has_storm'] then
+            storms = storms + 1
+        end
+    end
+
+    axia:ApiRequest('nav/sector_report_batch/', 'POST', reports,
         -- success handler
         function(data)
-            if has_storm then
-                axia:Log(axia.DATA, 'Ion storm reported')
+            if storms > 0 then
+                axia:Log(axia.DATA, '%d ion storm(s) reported', { storms })
             end
         end,
         -- error handler
         function(data)
-            for field, err in pairs(data['errors']) do
-                axia:Log(axia.ERROR, '%s: %s', { field, err })
+            for index, errors in pairs(data['errors']) do
+                for field, err in pairs(errors) do
+                    axia:Log(axia.ERROR, 'report %s, %s: %s', { index, field, table.concat(err, ' ') })
+                end
             end
         end
     )
@@ -146,6 +200,7 @@ end
 --
 --]]
 RegisterEvent(axia.OnEnterSector, 'SECTOR_LOADED')
+RegisterEvent(axia.SendSectorReports, 'PLAYER_LOGGED_OUT')
 
 --[[
 --
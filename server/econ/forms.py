@@ -14,6 +14,11 @@ class StationForm(forms.Form):
     sid = forms.IntegerField(min_value=0, required=True)
 
 
+class StationDigestForm(forms.Form):
+    station_id = forms.IntegerField(min_value=0, required=True)
+    digest = forms.CharField(min_length=40, max_length=40, required=True)
+
+
 class ItemForm(forms.Form):
     item_id = forms.IntegerField(min_value=0, required=True)
     item_name = forms.CharField(min_length=1, max_length=50, required=True)
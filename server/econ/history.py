@@ -0,0 +1,328 @@
+"""
+vo.econ.history
+
+Keeps the history of item prices as samples of (item_id, station_id,
+timestamp, price), taken of every price in each station report accepted,
+whether or not it has changed. Samples are held in memory as `array` columns
+for each item at each station, and rolled up into hourly and daily buckets of
+the lowest, highest and average price as they are added, for each station and
+across all stations, so that trends can be queried without reading every
+sample.
+
+Samples are kept for RETENTION seconds. If ECON_HISTORY_FILE is set, they
+are only appended to that file, as fixed-size records, and read back from it
+before every query; the file is shared by every process, and is the
+history's only storage. Otherwise, each process keeps the samples it has
+taken only until it exits. Once samples past RETENTION have built up for
+COMPACT_AFTER seconds, they are dropped, and the file is rewritten without
+them, so that neither it nor the samples held grow without bound.
+"""
+import bisect
+import fcntl
+import logging
+import os
+import struct
+import threading
+import time
+from array import array
+
+from django.conf import settings
+
+
+"""
+Path of the file samples are appended to, or None to keep them in memory.
+"""
+HISTORY_FILE = getattr(settings, 'ECON_HISTORY_FILE', None)
+
+"""
+Number of seconds samples are kept for, and the number of seconds of samples
+older than that which may build up before they are dropped.
+"""
+RETENTION = getattr(settings, 'ECON_HISTORY_RETENTION', 30 * 24 * 60 * 60)
+COMPACT_AFTER = getattr(settings, 'ECON_HISTORY_COMPACT_AFTER', 24 * 60 * 60)
+
+"""
+Length in seconds of the buckets of each rollup period.
+"""
+PERIODS = {
+    'hour': 60 * 60,
+    'day': 24 * 60 * 60,
+}
+
+"""
+Layout of a sample in HISTORY_FILE: item_id, station_id, timestamp (seconds
+since the epoch) and price.
+"""
+RECORD = struct.Struct('<HHqi')
+
+log = logging.getLogger(__name__)
+
+
+class Series(object):
+    """The samples of one item at one station, as columns of timestamps and
+    prices in time order.
+    """
+    __slots__ = ('times', 'prices')
+
+    def __init__(self):
+        self.times = array('l')
+        self.prices = array('l')
+
+    def add(self, when, price):
+        # Samples from several processes may be read slightly out of order.
+        if self.times and when < self.times[-1]:
+            i = bisect.bisect_right(self.times, when)
+            self.times.insert(i, when)
+            self.prices.insert(i, price)
+        else:
+            self.times.append(when)
+            self.prices.append(price)
+
+    def between(self, start, end):
+        """Returns (timestamp, price) for each sample from `start` to `end`
+        inclusive.
+        """
+        i = bisect.bisect_left(self.times, start)
+        j = bisect.bisect_right(self.times, end)
+        return zip(self.times[i:j], self.prices[i:j])
+
+
+class Rollup(object):
+    """Samples of one item, at one station or all of them, grouped into
+    buckets of `period` seconds. Each bucket is kept as its start along with
+    the lowest, highest and total price and the number of samples in it, in
+    columns ordered by start.
+    """
+    __slots__ = ('period', 'starts', 'lows', 'highs', 'totals', 'counts')
+
+    def __init__(self, period):
+        self.period = period
+        self.starts = array('l')
+        self.lows = array('l')
+        self.highs = array('l')
+        self.totals = array('d')
+        self.counts = array('l')
+
+    def add(self, when, price):
+        start = when - when % self.period
+        i = bisect.bisect_left(self.starts, start)
+
+        if i == len(self.starts) or self.starts[i] != start:
+            self.starts.insert(i, start)
+            self.lows.insert(i, price)
+            self.highs.insert(i, price)
+            self.totals.insert(i, price)
+            self.counts.insert(i, 1)
+        else:
+            self.lows[i] = min(self.lows[i], price)
+            self.highs[i] = max(self.highs[i], price)
+            self.totals[i] += price
+            self.counts[i] += 1
+
+    def between(self, start, end):
+        """Returns (bucket start, lowest, highest, average price, samples) for
+        each bucket holding samples from `start` to `end`.
+        """
+        i = bisect.bisect_right(self.starts, start - self.period)
+        j = bisect.bisect_right(self.starts, end)
+        return [(self.starts[k], self.lows[k], self.highs[k],
+                 self.totals[k] / self.counts[k], self.counts[k])
+                for k in xrange(i, j)]
+
+
+class PriceHistory(object):
+    """Price samples, as (item_id, station_id) => Series, with a Rollup for
+    each period of each item at each station, and of each item at all
+    stations (with a station_id of None). Samples are appended to the file
+    at `path`, if given, and read back from the `offset` reached so far.
+    Samples older than `retention` seconds are dropped once the oldest is
+    `compact_after` seconds past that.
+    """
+    def __init__(self, path=None, retention=RETENTION, compact_after=COMPACT_AFTER):
+        self.path = path
+        self.retention = retention
+        self.compact_after = compact_after
+        self.inode = None
+        self.lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self.offset = 0
+        self.oldest = None
+        self.series = dict()
+        self.rollups = dict((period, dict()) for period in PERIODS)
+
+    def _add(self, item, station, when, price):
+        series = self.series.get((item, station))
+        if series is None:
+            series = self.series[(item, station)] = Series()
+        series.add(when, price)
+
+        for period, rollups in self.rollups.iteritems():
+            for key in ((item, station), (item, None)):
+                rollup = rollups.get(key)
+                if rollup is None:
+                    rollup = rollups[key] = Rollup(PERIODS[period])
+                rollup.add(when, price)
+
+        if self.oldest is None or when < self.oldest:
+            self.oldest = when
+
+    def _keep(self, cutoff):
+        # Rebuilds the series and rollups from the samples taken from
+        # `cutoff` on, returning them in time order.
+        kept = []
+        for (item, station), series in self.series.iteritems():
+            i = bisect.bisect_left(series.times, cutoff)
+            kept.extend((item, station, when, price)
+                        for when, price in zip(series.times[i:], series.prices[i:]))
+        kept.sort(key=lambda sample: sample[2])
+
+        self._clear()
+        for sample in kept:
+            self._add(*sample)
+        return kept
+
+    def _expired(self):
+        return (self.oldest is not None and
+                self.oldest < time.time() - self.retention - self.compact_after)
+
+    def append(self, samples):
+        """Adds a list of (item_id, station_id, timestamp, price) samples.
+        Samples that cannot be written to the file are logged and lost.
+        """
+        if self.path is None:
+            with self.lock:
+                for sample in samples:
+                    self._add(*sample)
+                if self._expired():
+                    self._keep(int(time.time()) - self.retention)
+            return
+
+        data = ''.join(RECORD.pack(*sample) for sample in samples)
+        try:
+            self._write(data)
+        except (IOError, OSError), e:
+            log.error('Could not record %d price samples in %s: %s', len(samples), self.path, e)
+
+    def _write(self, data):
+        while True:
+            # A single write to a file opened for appending is not
+            # interleaved with those of other processes. The file is only
+            # replaced while compact holds an exclusive lock on it, so once
+            # a shared lock is taken, the file is the current one unless it
+            # has just been replaced.
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH)
+                if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                    os.write(fd, data)
+                    return
+            finally:
+                os.close(fd)
+
+    def _read(self):
+        try:
+            f = open(self.path, 'rb')
+        except IOError:
+            return
+
+        with f:
+            # The file has been compacted since it was last read.
+            inode = os.fstat(f.fileno()).st_ino
+            if inode != self.inode:
+                self._clear()
+                self.inode = inode
+
+            f.seek(self.offset)
+            data = f.read()
+
+        # A record still being written is read next time.
+        size = len(data) - len(data) % RECORD.size
+        for i in xrange(0, size, RECORD.size):
+            self._add(*RECORD.unpack_from(data, i))
+        self.offset += size
+
+    def refresh(self):
+        """Reads the samples appended to the file since it was last read,
+        compacting it if samples past `retention` have built up.
+        """
+        if self.path is None:
+            return
+
+        with self.lock:
+            self._read()
+            expired = self._expired()
+        if expired:
+            self.compact()
+
+    def compact(self):
+        """Drops the samples older than `retention` seconds, rewriting the
+        file with only the samples kept.
+        """
+        cutoff = int(time.time()) - self.retention
+        if self.path is None:
+            with self.lock:
+                self._keep(cutoff)
+            return
+
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except OSError:
+            return
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            # Another process may have compacted it while this one waited.
+            if os.fstat(fd).st_ino != os.stat(self.path).st_ino:
+                return
+
+            with self.lock:
+                self._read()
+                data = ''.join(RECORD.pack(*sample) for sample in self._keep(cutoff))
+
+                temporary = '%s.%d' % (self.path, os.getpid())
+                with open(temporary, 'wb') as f:
+                    f.write(data)
+                os.rename(temporary, self.path)
+                self.offset = len(data)
+                self.inode = os.stat(self.path).st_ino
+        except (IOError, OSError), e:
+            log.error('Could not compact the price history in %s: %s', self.path, e)
+        finally:
+            os.close(fd)
+
+    def samples(self, item, station, start, end):
+        """Returns (timestamp, price) for each sample of an item at a station
+        from `start` to `end`.
+        """
+        self.refresh()
+        with self.lock:
+            series = self.series.get((item, station))
+            return series.between(start, end) if series is not None else []
+
+    def rollup(self, item, station, period, start, end):
+        """Returns (bucket start, lowest, highest, average price, samples) for
+        each bucket of `period` holding samples of an item from `start` to
+        `end`, at a station or, if `station` is None, at all stations.
+        """
+        self.refresh()
+        with self.lock:
+            rollup = self.rollups[period].get((item, station))
+            return rollup.between(start, end) if rollup is not None else []
+
+
+HISTORY = PriceHistory(HISTORY_FILE)
+
+
+def record(station, prices, when=None):
+    """Takes a sample of each price in `prices`, a dictionary of item_id =>
+    price, at the station with station_id `station`, at `when` (by default,
+    now) in seconds since the epoch.
+    """
+    if when is None:
+        when = int(time.time())
+
+    samples = [(item, station, when, price) for item, price in prices.iteritems()]
+    if samples:
+        HISTORY.append(samples)
@@ -0,0 +1,192 @@
+"""
+vo.econ.index
+
+Keeps a process-local index of every sale, grouped by item and ordered by
+price, with the description of each sale already rendered, so that the econ
+views can answer from memory. The index is loaded the first time it is used
+and again once it is older than TTL seconds. Station reports handled by this
+process update it as they are committed; those handled by other processes
+are not seen until it is next loaded.
+"""
+import bisect
+import heapq
+import threading
+import time
+from itertools import islice
+
+from django.conf import settings
+
+from vo.econ.models import Item, SaleItem, sale_location
+from vo.econ.names import NameIndex
+
+
+"""
+Number of seconds the index is used for before it is loaded again.
+"""
+TTL = getattr(settings, 'ECON_INDEX_TTL', 300)
+
+
+class SaleIndex(object):
+    """The sales of every item, each as (price, station primary key), kept in
+    price order for each item. Items and stations are kept as the text they
+    are described with, along with the name and volume of each item and the
+    system id of each station. Items are found by name through `names`, a
+    NameIndex.
+    """
+    def __init__(self):
+        self.items = dict()
+        self.volumes = dict()
+        self.names = NameIndex()
+        self.stations = dict()
+        self.prices = dict()
+        self.sales = dict()
+        self.by_station = dict()
+        self.lock = threading.RLock()
+
+    def add_item(self, item):
+        """Adds or updates an Item, redescribing its sales if its description
+        has changed.
+        """
+        with self.lock:
+            text = repr(item)
+            self.volumes[item.pk] = item.volume
+            previous = self.items.get(item.pk)
+            if previous is not None and previous[1] == text:
+                return
+
+            if previous is not None:
+                self.names.remove(item.pk, previous[0])
+            self.items[item.pk] = (item.item_name, text)
+            self.names.add(item.pk, item.item_name)
+
+            for _, station in self.prices.get(item.pk, ()):
+                self._describe(item.pk, station)
+
+    def add_station(self, station):
+        """Adds or updates a Station, redescribing its sales if its
+        description has changed.
+        """
+        with self.lock:
+            text = repr(station)
+            previous = self.stations.get(station.pk)
+            if previous is not None and previous[1] == text:
+                return
+
+            self.stations[station.pk] = (station.sid, text)
+            for item in self.by_station.get(station.pk, ()):
+                self._describe(item, station.pk)
+
+    def set_price(self, item, station, price):
+        """Records that the Item with primary key `item` is sold for `price`
+        at the Station with primary key `station`. Both must have been added.
+        """
+        with self.lock:
+            self.remove(item, station)
+            bisect.insort(self.prices.setdefault(item, []), (price, station))
+            self.by_station.setdefault(station, set()).add(item)
+            self._describe(item, station, price)
+
+    def remove(self, item, station):
+        """Records that an item is no longer sold at a station.
+        """
+        with self.lock:
+            sale = self.sales.pop((item, station), None)
+            if sale is None:
+                return
+
+            prices = self.prices[item]
+            del prices[bisect.bisect_left(prices, (sale[0], station))]
+            self.by_station[station].discard(item)
+
+    def _describe(self, item, station, price=None):
+        if price is None:
+            price = self.sales[(item, station)][0]
+        text = sale_location(self.items[item][1], self.stations[station][1], price)
+        self.sales[(item, station)] = (price, text)
+
+    def in_price_order(self, items):
+        """Generates (price, station primary key, item primary key) for every
+        sale of any of the items with primary keys `items`, cheapest first.
+        The index's lock must be held while the sales are generated.
+        """
+        return heapq.merge(*[_tagged(self.prices.get(item, ()), item) for item in items])
+
+    def station_system(self, station):
+        """Returns the system id of the Station with primary key `station`.
+        """
+        return self.stations[station][0]
+
+    def description(self, item, station):
+        """Returns the description of the sale of an item at a station.
+        """
+        return self.sales[(item, station)][1]
+
+    def cheapest(self, items, limit):
+        """Returns the descriptions of the `limit` cheapest sales of any of
+        the items with primary keys `items`, cheapest first.
+        """
+        with self.lock:
+            sales = islice(self.in_price_order(items), limit)
+            return [self.description(item, station) for _, station, item in sales]
+
+    def apply(self, changes):
+        """Applies the InventoryChanges made by `apply_inventory`.
+        """
+        with self.lock:
+            self.add_station(changes.station)
+            for item in changes.items.itervalues():
+                self.add_item(item)
+
+            for item in changes.removed:
+                self.remove(item, changes.station.pk)
+            for item, price in changes.added.iteritems():
+                self.set_price(item, changes.station.pk, price)
+            for item, price in changes.changed.iteritems():
+                self.set_price(item, changes.station.pk, price)
+
+
+def _tagged(prices, item):
+    for price, station in prices:
+        yield price, station, item
+
+
+_lock = threading.Lock()
+_index = None
+_expires = None
+
+
+def index():
+    """Returns the current SaleIndex, loading it if it has expired.
+    """
+    global _index, _expires
+
+    with _lock:
+        if _index is None or time.time() >= _expires:
+            _index = load()
+            _expires = time.time() + TTL
+        return _index
+
+
+def apply(changes):
+    """Applies committed InventoryChanges to the current SaleIndex, if one has
+    been loaded.
+    """
+    current = _index
+    if current is not None:
+        current.apply(changes)
+
+
+def load():
+    """Loads a SaleIndex of every item and sale.
+    """
+    loaded = SaleIndex()
+
+    for item in Item.objects.all():
+        loaded.add_item(item)
+
+    for sale in SaleItem.objects.select_related('station__faction'):
+        if sale.station_id not in loaded.stations:
+            loaded.add_station(sale.station)
+        loaded.set_price(sale.item_id, sale.station_id, sale.price)
+
+    return loaded
@@ -0,0 +1,102 @@
+"""
+vo.econ.inventory
+
+Applies a station's reported merchandise to Item and SaleItem in a fixed
+number of queries, however many items the station sells. The reported items
+and the station's sale rows are fetched up front, and only the differences
+are written, in bulk.
+
+Each station keeps a digest of the inventory last reported for it, so that
+reports of an unchanged inventory need not write anything, or even be sent
+in full.
+"""
+import hashlib
+
+from vo.econ.models import Item, SaleItem
+from vo.util.models import bulk_update
+
+
+class InventoryChanges(object):
+    """The changes made by `apply_inventory` to one station's sale rows, each
+    a dictionary of Item primary key => price (the previous price, for
+    `removed`).
+    """
+    def __init__(self, station):
+        self.station = station
+        self.items = dict()
+        self.added = dict()
+        self.changed = dict()
+        self.removed = dict()
+
+    def __nonzero__(self):
+        return bool(self.added or self.changed or self.removed)
+
+
+def inventory_digest(items):
+    """Returns the hex SHA-1 digest of `items`, a dictionary of item_id =>
+    (item_name, volume, price), which does not depend on the order in which
+    the items were reported.
+    """
+    lines = [u'%d:%s:%d:%d' % (k, name, volume, price)
+             for k, (name, volume, price) in sorted(items.iteritems())]
+    return hashlib.sha1(u'\n'.join(lines).encode('utf-8')).hexdigest()
+
+
+def apply_inventory(station, items):
+    """Brings the sale rows for `station` in line with `items`, a dictionary
+    of item_id => (item_name, volume, price) for everything it sells. Items
+    not yet known are created, and sale rows for items no longer sold there
+    are removed. Returns the InventoryChanges made, with `items` holding the
+    Item for each reported item_id.
+    """
+    changes = InventoryChanges(station)
+
+    known = dict((i.item_id, i) for i in Item.objects.filter(item_id__in=list(items)))
+
+    missing = [Item(item_id=k, item_name=name, volume=volume)
+               for k, (name, volume, _) in items.iteritems() if k not in known]
+    if missing:
+        # Primary keys are not set by bulk_create on every database.
+        Item.objects.bulk_create(missing)
+        created = Item.objects.filter(item_id__in=[i.item_id for i in missing])
+        known.update((i.item_id, i) for i in created)
+
+    renamed = dict()
+    for item_id, (name, volume, _) in items.iteritems():
+        item = known[item_id]
+        if item.item_name != name or item.volume != volume:
+            item.item_name = name
+            item.volume = volume
+            renamed[item.pk] = {'item_name': name, 'volume': volume}
+    bulk_update(Item, renamed)
+
+    changes.items = dict((k, known[k]) for k in items)
+
+    sales = SaleItem.objects.filter(station=station).values_list('pk', 'item', 'price')
+    existing = dict((item, (pk, price)) for pk, item, price in sales)
+
+    prices = dict((known[k].pk, price) for k, (_, _, price) in items.iteritems())
+    repriced = dict()
+
+    for item, price in prices.iteritems():
+        if item not in existing:
+            changes.added[item] = price
+        elif existing[item][1] != price:
+            changes.changed[item] = price
+            repriced[existing[item][0]] = {'price': price}
+
+    for item, (pk, price) in existing.iteritems():
+        if item not in prices:
+            changes.removed[item] = price
+
+    if changes.added:
+        SaleItem.objects.bulk_create(
+            [SaleItem(item_id=item, station=station, price=price)
+             for item, price in changes.added.iteritems()])
+
+    bulk_update(SaleItem, repriced)
+
+    if changes.removed:
+        SaleItem.objects.filter(station=station, item__in=list(changes.removed)).delete()
+
+    return changes
@@ -19,6 +19,9 @@ class Station(AbstractSector):
     station_name = models.CharField(max_length=50, unique=True)
     faction = models.ForeignKey(Faction)
 
+    # Digest of the last inventory reported (see vo.econ.inventory)
+    inventory_digest = models.CharField(max_length=40, blank=True, default='')
+
     def __repr__(self):
         return '%s (%s @ %s)' % (self.station_name, self.faction, self.location_str())
 
@@ -47,7 +50,14 @@ class SaleItem(models.Model):
         unique_together = ('item', 'station')
 
     def __repr__(self):
-        return '%s @ %s for %dc' % (self.item, self.station, self.price)
+        return sale_location(self.item, self.station, self.price)
 
     def __unicode__(self):
         return repr(self)
+
+
+def sale_location(item, station, price):
+    """Returns the description of a sale of `item` at `station`, either of
+    which may be a model instance or the text of one.
+    """
+    return '%s @ %s for %dc' % (item, station, price)
@@ -0,0 +1,143 @@
+"""
+vo.econ.names
+
+Resolves the item names players type into items. Names are compared once
+normalized (see `normalize`), and may be looked up exactly, by prefix, for
+autocompletion, or by similarity, for names that have been mistyped.
+Similarity is the proportion of the trigrams (runs of three characters) of
+two names that they share.
+"""
+import bisect
+import threading
+
+
+"""
+Least similarity for a name to be taken as a mistyping of another.
+"""
+THRESHOLD = 0.3
+
+
+def normalize(name):
+    """Returns `name` in lower case, with runs of whitespace made single
+    spaces and none leading or trailing.
+    """
+    return u' '.join(name.lower().split())
+
+
+def trigrams(name):
+    """Returns the set of trigrams of a normalized name, padded with spaces
+    so that its start and end count for more.
+    """
+    padded = u'  %s ' % name
+    return set(padded[i:i + 3] for i in xrange(0, len(padded) - 2))
+
+
+class NameIndex(object):
+    """The primary keys of items by normalized name, along with each name as
+    first given, the normalized names in sorted order and, for each trigram,
+    the normalized names it is found in.
+    """
+    def __init__(self):
+        self.items = dict()
+        self.names = dict()
+        self.ordered = []
+        self.grams = dict()
+        self.lock = threading.Lock()
+
+    def add(self, item, name):
+        """Adds the item with primary key `item` under `name`.
+        """
+        key = normalize(name)
+        with self.lock:
+            if key not in self.items:
+                self.items[key] = set()
+                self.names[key] = name
+                bisect.insort(self.ordered, key)
+                for gram in trigrams(key):
+                    self.grams.setdefault(gram, set()).add(key)
+            self.items[key].add(item)
+
+    def remove(self, item, name):
+        """Removes the item with primary key `item` from under `name`.
+        """
+        key = normalize(name)
+        with self.lock:
+            items = self.items.get(key)
+            if items is None:
+                return
+
+            items.discard(item)
+            if not items:
+                del self.items[key]
+                del self.names[key]
+                del self.ordered[bisect.bisect_left(self.ordered, key)]
+                for gram in trigrams(key):
+                    self.grams[gram].discard(key)
+
+    def exact(self, name):
+        """Returns the primary keys of the items named `name`.
+        """
+        with self.lock:
+            return sorted(self.items.get(normalize(name), ()))
+
+    def prefix(self, text, limit):
+        """Returns up to `limit` names starting with `text`, in order.
+        """
+        key = normalize(text)
+        with self.lock:
+            i = bisect.bisect_left(self.ordered, key)
+            found = []
+            for name in self.ordered[i:i + limit]:
+                if not name.startswith(key):
+                    break
+                found.append(self.names[name])
+            return found
+
+    def similar(self, text, limit):
+        """Returns up to `limit` names at least THRESHOLD similar to `text`,
+        most similar first.
+        """
+        grams = trigrams(normalize(text))
+        with self.lock:
+            shared = dict()
+            for gram in grams:
+                for name in self.grams.get(gram, ()):
+                    shared[name] = shared.get(name, 0) + 1
+
+            scored = []
+            for name, count in shared.iteritems():
+                similarity = float(count) / (len(grams) + len(trigrams(name)) - count)
+                if similarity >= THRESHOLD:
+                    scored.append((-similarity, name))
+
+            scored.sort()
+            return [self.names[name] for _, name in scored[:limit]]
+
+    def resolve(self, name):
+        """Returns the name of the items named `name`, as first given, along
+        with their primary keys. If there are none, and only one name is at
+        least THRESHOLD similar to `name`, returns that name and its items
+        instead. Otherwise returns None and no items.
+        """
+        with self.lock:
+            key = normalize(name)
+            if key in self.items:
+                return self.names[key], sorted(self.items[key])
+
+        similar = self.similar(name, 2)
+        if len(similar) != 1:
+            return None, []
+        return similar[0], self.exact(similar[0])
+
+    def complete(self, text, limit):
+        """Returns up to `limit` names starting with `text` or, after those,
+        most similar to it.
+        """
+        names = self.prefix(text, limit)
+        if len(names) < limit:
+            for name in self.similar(text, limit):
+                if name not in names:
+                    names.append(name)
+                    if len(names) == limit:
+                        break
+        return names
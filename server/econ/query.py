@@ -0,0 +1,98 @@
+"""
+vo.econ.query
+
+Finds the best places to buy an item, weighing the price at each station
+against the number of jumps to it from the buyer's system. Sales come from
+the SaleIndex (see `vo.econ.index`) in price order, so a query stops reading
+them once no later sale could rank among those it has found.
+"""
+import heapq
+
+from vo.util.info import SYSTEM_NAMES, short_system_name
+from vo.util.nav import jump_distances
+
+
+_HOPS = dict()
+
+
+def hops_from(sid):
+    """Returns a list of the number of jumps to each system id from system id
+    `sid`, with None for systems that cannot be reached.
+    """
+    hops = _HOPS.get(sid)
+    if hops is None:
+        distances = jump_distances(short_system_name(SYSTEM_NAMES[sid]))
+        hops = [None] * len(SYSTEM_NAMES)
+        for other, name in enumerate(SYSTEM_NAMES):
+            if name is not None:
+                hops[other] = distances.get(short_system_name(name))
+        _HOPS[sid] = hops
+    return hops
+
+
+class Result(object):
+    """A sale found by a query, with the number of jumps to its station and
+    the score it was ranked by.
+    """
+    __slots__ = ('score', 'hops', 'price', 'description')
+
+    def __init__(self, score, hops, price, description):
+        self.score = score
+        self.hops = hops
+        self.price = price
+        self.description = description
+
+    def __repr__(self):
+        return '%s (%d jumps)' % (self.description, self.hops)
+
+
+def cheapest_within(sales, items, sid, max_jumps=None, limit=6, weight=0):
+    """Returns up to `limit` Results for the sales in SaleIndex `sales` of
+    any of the items with primary keys `items`, at stations no more than
+    `max_jumps` from system id `sid`. Sales are ranked by their price plus
+    `weight` credits for each jump to them, then by jumps and price.
+    """
+    hops = hops_from(sid)
+    best = []
+
+    with sales.lock:
+        for price, station, item in sales.in_price_order(items):
+            # Every later sale scores at least its price.
+            if len(best) == limit and price > -best[0][0]:
+                break
+
+            distance = hops[sales.station_system(station)]
+            if distance is None or (max_jumps is not None and distance > max_jumps):
+                continue
+
+            score = price + weight * distance
+            key = (-score, -distance, -price)
+            if len(best) < limit:
+                heapq.heappush(best, key + (station, item))
+            elif key > best[0][:3]:
+                heapq.heapreplace(best, key + (station, item))
+
+        results = [Result(-score, -distance, -price, sales.description(item, station))
+                   for score, distance, price, station, item in best]
+
+    results.sort(key=lambda r: (r.score, r.hops, r.price))
+    return results
+
+
+def nearest(sales, items, sid, limit=6):
+    """Returns up to `limit` Results for the sales in SaleIndex `sales` of
+    any of the items with primary keys `items`, fewest jumps from system id
+    `sid` first and cheapest first among those as far away.
+    """
+    hops = hops_from(sid)
+    ranked = []
+
+    with sales.lock:
+        for price, station, item in sales.in_price_order(items):
+            distance = hops[sales.station_system(station)]
+            if distance is not None:
+                ranked.append((distance, price, station, item))
+
+        ranked = heapq.nsmallest(limit, ranked)
+        return [Result(distance, distance, price, sales.description(item, station))
+                for distance, price, station, item in ranked]
@@ -0,0 +1,214 @@
+import json
+import time
+
+from django.test import SimpleTestCase, TestCase
+from django.test.client import RequestFactory
+from django.utils.unittest import skipIf
+
+from vo.econ import history, query, trade, views
+from vo.econ.index import SaleIndex
+from vo.econ.inventory import apply_inventory
+from vo.econ.models import Faction, Item, SaleItem, Station
+from vo.econ.names import NameIndex
+
+
+class StationReportTest(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.items = [
+            {'item_id': 1, 'item_name': 'Xith Ore', 'volume': 1, 'price': 100},
+            {'item_id': 2, 'item_name': 'Ferric Ore', 'volume': 1, 'price': 200},
+        ]
+
+    def report(self, data):
+        request = self.factory.post('/', {'data': json.dumps(data)})
+        return json.loads(views.station_report(request).content)
+
+    def full_report(self):
+        return self.report({
+            'faction_id': 1, 'faction_name': 'Itani',
+            'station_id': 7, 'station_name': 'Dau L-10 Station', 'sid': 19, 'x': 11, 'y': 9,
+            'items': self.items,
+        })
+
+    def test_unchanged(self):
+        """
+        Tests that reporting an unchanged inventory again writes nothing,
+        whether it is reported in full or by its digest.
+        """
+        digest = self.full_report()['digest']
+
+        # Looking up the faction and the station.
+        with self.assertNumQueries(2):
+            result = self.full_report()
+        self.assertEqual(result, {'result': 'success', 'digest': digest, 'unchanged': True})
+
+        # Applied anyway, only the items and sale rows are fetched.
+        station = Station.objects.get(station_id=7)
+        items = dict((i['item_id'], (i['item_name'], i['volume'], i['price'])) for i in self.items)
+        with self.assertNumQueries(2):
+            self.assertFalse(apply_inventory(station, items))
+
+        result = self.report({'station_id': 7, 'digest': digest})
+        self.assertEqual(result, {'result': 'success', 'digest': digest, 'unchanged': True})
+
+    def test_changed_price(self):
+        """
+        Tests that a changed price updates only the sale row of that item.
+        """
+        self.full_report()
+        station = Station.objects.get(station_id=7)
+        ore = Item.objects.get(item_id=1)
+
+        # Fetching the items and the sale rows, then updating one row.
+        with self.assertNumQueries(3):
+            changes = apply_inventory(station, {1: ('Xith Ore', 1, 120), 2: ('Ferric Ore', 1, 200)})
+
+        self.assertEqual(changes.changed, {ore.pk: 120})
+        self.assertEqual(changes.added, {})
+        self.assertEqual(changes.removed, {})
+        self.assertEqual(dict(SaleItem.objects.values_list('item__item_id', 'price')), {1: 120, 2: 200})
+
+    def test_stale_digest(self):
+        """
+        Tests that a digest other than that of the inventory last reported
+        is refused as stale.
+        """
+        digest = self.full_report()['digest']
+        self.items[0]['price'] = 150
+        self.assertNotEqual(self.full_report()['digest'], digest)
+
+        result = self.report({'station_id': 7, 'digest': digest})
+        self.assertEqual(result['result'], 'failure')
+        self.assertTrue(result['stale'])
+
+
+class QueryTest(SimpleTestCase):
+    def setUp(self):
+        """
+        Sells Xith Ore at two stations in Dau, and in Nyrius one jump away
+        and Ukari two jumps away.
+        """
+        self.sales = SaleIndex()
+        self.sales.add_item(Item(pk=1, item_id=1, item_name='Xith Ore', volume=1))
+
+        faction = Faction(pk=1, faction_id=1, faction_name='Itani')
+        for pk, sid, price in ((1, 19, 120), (2, 18, 100), (3, 25, 80), (4, 19, 110)):
+            self.sales.add_station(Station(pk=pk, station_id=pk, station_name='Station %d' % pk,
+                                           faction=faction, sid=sid, x=1, y=1))
+            self.sales.set_price(1, pk, price)
+
+    def prices(self, results):
+        return [(r.hops, r.price) for r in results]
+
+    def test_cheapest(self):
+        self.assertEqual(len(self.sales.cheapest([1], 2)), 2)
+        self.assertTrue(self.sales.cheapest([1], 1)[0].endswith('for 80c'))
+
+    def test_nearest(self):
+        """
+        Tests that sales are ranked by jumps, then by price.
+        """
+        results = query.nearest(self.sales, [1], 19, 3)
+        self.assertEqual(self.prices(results), [(0, 110), (0, 120), (1, 100)])
+
+    def test_cheapest_within(self):
+        """
+        Tests that sales are limited to those within 'max_jumps', and ranked
+        by price plus 'weight' for each jump.
+        """
+        results = query.cheapest_within(self.sales, [1], 19, 1, 6)
+        self.assertEqual(self.prices(results), [(1, 100), (0, 110), (0, 120)])
+
+        results = query.cheapest_within(self.sales, [1], 19, None, 2)
+        self.assertEqual(self.prices(results), [(2, 80), (1, 100)])
+
+        results = query.cheapest_within(self.sales, [1], 19, None, 4, weight=15)
+        self.assertEqual([r.score for r in results], [110, 110, 115, 120])
+        self.assertEqual(self.prices(results), [(0, 110), (2, 80), (1, 100), (0, 120)])
+
+
+@skipIf(trade.numpy is None, 'numpy is not installed')
+class TradeMatrixTest(SimpleTestCase):
+    def test_profit(self):
+        """
+        Tests that runs are ranked by profit per cu per jump, counting a run
+        within a system as one jump.
+        """
+        matrix = trade.TradeMatrix()
+        matrix.set_price(1, 2, 1, 19, 100)
+        matrix.set_price(1, 2, 2, 18, 150)
+        matrix.set_price(1, 2, 3, 25, 260)
+
+        runs = [(r.buy, r.sell, r.jumps, round(r.profit, 2)) for r in matrix.best(6)]
+        self.assertEqual(runs, [(1, 3, 2, 40.0), (1, 2, 1, 25.0), (2, 3, 3, 18.33)])
+
+        # A second station in the same system as the first.
+        matrix.set_price(1, 2, 4, 19, 120)
+        runs = matrix.best(6)
+        self.assertEqual(len(runs), 6)
+        self.assertEqual((runs[1].buy, runs[1].sell, runs[1].profit), (4, 3, 35.0))
+        self.assertEqual((runs[-1].buy, runs[-1].sell, runs[-1].jumps, runs[-1].profit), (1, 4, 0, 10.0))
+
+    def test_limit(self):
+        """
+        Tests that no more than RUNS_PER_ITEM runs are returned.
+        """
+        matrix = trade.TradeMatrix()
+        for station in xrange(0, 8):
+            matrix.set_price(1, 1, station, 19, 100 + station)
+        self.assertEqual(len(matrix.best(2)), 2)
+        self.assertEqual(len(matrix.best(50)), trade.RUNS_PER_ITEM)
+
+
+class PriceHistoryTest(SimpleTestCase):
+    def test_rollup(self):
+        """
+        Tests that samples are rolled up by station and across stations.
+        """
+        prices = history.PriceHistory()
+        hour = history.PERIODS['hour']
+        start = int(time.time()) // hour * hour - 2 * hour
+        prices.append([(1, 7, start, 100), (1, 7, start + 60, 120), (1, 8, start + 90, 50),
+                       (1, 7, start + hour, 110)])
+
+        self.assertEqual(prices.samples(1, 7, start, start + hour - 1), [(start, 100), (start + 60, 120)])
+        self.assertEqual(prices.rollup(1, 7, 'hour', start, start + hour),
+                         [(start, 100, 120, 110.0, 2), (start + hour, 110, 110, 110.0, 1)])
+        self.assertEqual(prices.rollup(1, None, 'hour', start, start),
+                         [(start, 50, 120, 90.0, 3)])
+
+    def test_retention(self):
+        """
+        Tests that samples past the retention are dropped once they have
+        built up.
+        """
+        prices = history.PriceHistory(retention=100, compact_after=50)
+        now = int(time.time())
+        prices.append([(1, 7, now - 120, 100)])
+        self.assertEqual(len(prices.samples(1, 7, 0, now)), 1)
+
+        prices.append([(1, 7, now - 200, 90), (1, 7, now, 110)])
+        self.assertEqual(prices.samples(1, 7, 0, now), [(now, 110)])
+        self.assertEqual(prices.rollup(1, None, 'day', 0, now)[0][4], 1)
+
+
+class NameIndexTest(SimpleTestCase):
+    def setUp(self):
+        self.names = NameIndex()
+        for pk, name in enumerate(['Xith Ore', 'Ferric Ore', 'Lasers', 'Laser Drill']):
+            self.names.add(pk, name)
+
+    def test_resolve(self):
+        """
+        Tests that names are resolved exactly once normalized, or by the one
+        name similar to them, and not when several are.
+        """
+        self.assertEqual(self.names.resolve(' xith  ORE'), ('Xith Ore', [0]))
+        self.assertEqual(self.names.resolve('Xth Ore'), ('Xith Ore', [0]))
+        self.assertEqual(self.names.resolve('laser'), (None, []))
+        self.assertEqual(self.names.similar('laser', 5), ['Lasers', 'Laser Drill'])
+
+    def test_complete(self):
+        self.assertEqual(self.names.complete('las', 1), ['Laser Drill'])
+        self.assertEqual(self.names.complete('ore', 5)[:1], ['Xith Ore'])
@@ -0,0 +1,257 @@
+"""
+vo.econ.trade
+
+Finds the most profitable trade runs: buying an item at one station and
+selling it at another where it is listed for more. Listed prices are taken
+as the price a station buys at as well as sells at. Runs are ranked by
+profit per unit of cargo space per jump, since a ship carries a fixed volume
+and time is spent jumping.
+
+Prices are kept in a dense items x stations NumPy array, built from the
+SaleIndex (see `vo.econ.index`) and updated cell by cell as station reports
+are applied. The best runs for each item are only recomputed once its prices
+have changed. NumPy is required; without it, `matrix` raises ImportError.
+"""
+import heapq
+import threading
+
+from vo.econ import index
+from vo.econ.query import hops_from
+from vo.util.info import SYSTEM_NAMES
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+"""
+Number of runs kept for each item, from which the best runs overall are
+chosen, and so the most runs that may be asked for at once.
+"""
+RUNS_PER_ITEM = 10
+
+
+class Run(object):
+    """A trade run: buying the Item with primary key `item` at Station `buy`
+    for `buy_price` and selling it at Station `sell` for `sell_price`,
+    `jumps` jumps away, for `profit` credits per cu per jump.
+    """
+    __slots__ = ('profit', 'item', 'buy', 'buy_price', 'sell', 'sell_price', 'jumps')
+
+    def __init__(self, profit, item, buy, buy_price, sell, sell_price, jumps):
+        self.profit = profit
+        self.item = item
+        self.buy = buy
+        self.buy_price = buy_price
+        self.sell = sell
+        self.sell_price = sell_price
+        self.jumps = jumps
+
+
+class TradeMatrix(object):
+    """The price of every item at every station, as an array with a row for
+    each item and a column for each station (NaN where an item is not sold),
+    along with the volume of each item and the system of each station.
+    """
+    def __init__(self):
+        self.rows = dict()
+        self.items = []
+        self.columns = dict()
+        self.stations = []
+        self.prices = numpy.empty((0, 0))
+        self.volumes = numpy.empty(0)
+        self.systems = numpy.empty(0, dtype=int)
+        self.runs = dict()
+        self.dirty = set()
+        self.lock = threading.RLock()
+
+        # Jumps between every pair of system ids, NaN where there is no way
+        # between them.
+        self.hops = numpy.array(
+            [[numpy.nan if h is None else h for h in _hops(sid)] for sid in xrange(0, len(SYSTEM_NAMES))])
+
+    def _grow(self, rows, columns):
+        # Capacity is doubled as needed, so adding items or stations one at
+        # a time does not copy the array every time.
+        capacity = self.prices.shape
+        if rows <= capacity[0] and columns <= capacity[1]:
+            return
+
+        shape = (max(rows, capacity[0] * 2), max(columns, capacity[1] * 2))
+        prices = numpy.empty(shape)
+        prices.fill(numpy.nan)
+        prices[:capacity[0], :capacity[1]] = self.prices
+        self.prices = prices
+
+        volumes = numpy.ones(shape[0])
+        volumes[:capacity[0]] = self.volumes
+        self.volumes = volumes
+
+        systems = numpy.zeros(shape[1], dtype=int)
+        systems[:capacity[1]] = self.systems
+        self.systems = systems
+
+    def _row(self, item, volume):
+        row = self.rows.get(item)
+        if row is None:
+            row = len(self.items)
+            self._grow(row + 1, len(self.stations))
+            self.rows[item] = row
+            self.items.append(item)
+        if self.volumes[row] != volume:
+            self.volumes[row] = volume
+            self.dirty.add(row)
+        return row
+
+    def _column(self, station, sid):
+        column = self.columns.get(station)
+        if column is None:
+            column = len(self.stations)
+            self._grow(len(self.items), column + 1)
+            self.columns[station] = column
+            self.stations.append(station)
+        self.systems[column] = sid
+        return column
+
+    def set_price(self, item, volume, station, sid, price):
+        """Records the price of an item at a station.
+        """
+        with self.lock:
+            row = self._row(item, volume)
+            column = self._column(station, sid)
+            self.prices[row, column] = price
+            self.dirty.add(row)
+
+    def remove(self, item, station):
+        """Records that an item is no longer sold at a station.
+        """
+        with self.lock:
+            row = self.rows.get(item)
+            column = self.columns.get(station)
+            if row is not None and column is not None:
+                self.prices[row, column] = numpy.nan
+                self.dirty.add(row)
+
+    def item_runs(self, row):
+        """Returns the RUNS_PER_ITEM most profitable Runs for the item in
+        `row`, most profitable first.
+        """
+        prices = self.prices[row, :len(self.stations)]
+        columns = numpy.flatnonzero(~numpy.isnan(prices))
+        if len(columns) < 2:
+            return []
+
+        prices = prices[columns]
+        systems = self.systems[columns]
+        jumps = self.hops[numpy.ix_(systems, systems)]
+
+        # Rows are the station bought at and columns the station sold at.
+        spread = prices[None, :] - prices[:, None]
+        profit = spread / self.volumes[row] / numpy.maximum(jumps, 1)
+        profit[~(spread > 0) | numpy.isnan(jumps)] = -numpy.inf
+
+        flat = profit.ravel()
+        count = min(RUNS_PER_ITEM, len(flat))
+        best = numpy.argpartition(-flat, count - 1)[:count]
+        best = best[numpy.argsort(-flat[best])]
+
+        runs = []
+        for i in best:
+            if flat[i] == -numpy.inf:
+                break
+            buy, sell = divmod(int(i), len(columns))
+            runs.append(Run(float(flat[i]), self.items[row],
+                            self.stations[columns[buy]], int(prices[buy]),
+                            self.stations[columns[sell]], int(prices[sell]),
+                            int(jumps[buy, sell])))
+        return runs
+
+    def best(self, limit):
+        """Returns the `limit` (at most RUNS_PER_ITEM) most profitable Runs,
+        most profitable first.
+        """
+        limit = min(limit, RUNS_PER_ITEM)
+        with self.lock:
+            for row in self.dirty:
+                self.runs[row] = self.item_runs(row)
+            self.dirty.clear()
+
+            runs = [run for item_runs in self.runs.itervalues() for run in item_runs]
+            return heapq.nlargest(limit, runs, key=lambda r: r.profit)
+
+    def apply(self, changes):
+        """Applies the InventoryChanges made by `apply_inventory`.
+        """
+        station = changes.station
+        volumes = dict((item.pk, item.volume) for item in changes.items.itervalues())
+
+        with self.lock:
+            for item in changes.removed:
+                self.remove(item, station.pk)
+            for prices in (changes.added, changes.changed):
+                for item, price in prices.iteritems():
+                    self.set_price(item, volumes[item], station.pk, station.sid, price)
+
+            # Items not repriced may have changed volume.
+            for item, volume in volumes.iteritems():
+                if item in self.rows:
+                    self._row(item, volume)
+
+
+def describe(sales, run):
+    """Returns the description of a Run, with its item and stations described
+    as in SaleIndex `sales`.
+    """
+    with sales.lock:
+        return '%s: buy @ %s for %dc, sell @ %s for %dc (%d jumps, %.1fc/cu/jump)' % (
+            sales.items[run.item][1], sales.stations[run.buy][1], run.buy_price,
+            sales.stations[run.sell][1], run.sell_price, run.jumps, run.profit)
+
+
+def _hops(sid):
+    if SYSTEM_NAMES[sid] is None:
+        return [None] * len(SYSTEM_NAMES)
+    return hops_from(sid)
+
+
+_lock = threading.Lock()
+_matrix = None
+_source = None
+
+
+def matrix():
+    """Returns the TradeMatrix for the current SaleIndex, building it when the
+    index has been loaded again. Raises ImportError without NumPy.
+    """
+    global _matrix, _source
+
+    if numpy is None:
+        raise ImportError('trade runs require numpy')
+
+    sales = index.index()
+    with _lock:
+        if _source is not sales:
+            _matrix = build(sales)
+            _source = sales
+        return _matrix
+
+
+def apply(changes):
+    """Applies committed InventoryChanges to the current TradeMatrix, if one
+    has been built.
+    """
+    current = _matrix
+    if current is not None:
+        current.apply(changes)
+
+
+def build(sales):
+    """Builds a TradeMatrix of the prices in SaleIndex `sales`.
+    """
+    built = TradeMatrix()
+    with sales.lock:
+        for item, prices in sales.prices.iteritems():
+            for price, station in prices:
+                built.set_price(item, sales.volumes[item], station, sales.station_system(station), price)
+    return built
@@ -4,4 +4,7 @@ urlpatterns = patterns('',
     url(r'^station_report/$', 'vo.econ.views.station_report'),
     url(r'^nearest_items/$', 'vo.econ.views.nearest_sale_locations'),
     url(r'^cheapest_items/$', 'vo.econ.views.cheapest_sale_locations'),
+    url(r'^trade_routes/$', 'vo.econ.views.trade_routes'),
+    url(r'^price_history/$', 'vo.econ.views.price_history'),
+    url(r'^item_names/$', 'vo.econ.views.item_names'),
 )
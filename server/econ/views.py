@@ -1,14 +1,39 @@
 import json
+import time
 
+from django.conf import settings
 from django.db import transaction
 from django.http import HttpResponseBadRequest
 from django.views.decorators.http import require_http_methods
 
-from vo.econ.forms import StationForm, FactionForm, ItemForm, SaleItemForm
-from vo.econ.models import Station, Faction, Item, SaleItem
+from vo.econ import history, index, query, trade
+from vo.econ.forms import StationForm, StationDigestForm, FactionForm, ItemForm, SaleItemForm
+from vo.econ.inventory import apply_inventory, inventory_digest
+from vo.econ.models import Item, SaleItem, Station, Faction
 from vo.util import JsonResponse
-from vo.util.nav import shortest_jump_plans
-from vo.util.info import SYSTEM_NAMES, short_system_name
+from vo.util.info import SYSTEM_NAMES
+
+
+"""
+Number of locations returned by the econ queries when no 'limit' is given,
+and the most that may be asked for.
+"""
+DEFAULT_LIMIT = 6
+MAX_LIMIT = getattr(settings, 'ECON_MAX_LIMIT', 50)
+
+"""
+Number of similar item names suggested when an item is not found.
+"""
+SUGGESTIONS = 5
+
+
+class ItemNotFound(ValueError):
+    """Raised when no item has the name asked for, nor is any one name alone
+    similar to it, with the most similar names as `suggestions`.
+    """
+    def __init__(self, suggestions):
+        ValueError.__init__(self, 'Item not found')
+        self.suggestions = suggestions
 
 
 def validation_error_response(label, form):
@@ -20,29 +45,51 @@ def validation_error_response(label, form):
     return JsonResponse({'result': 'failure', 'label': label, 'errors': errors})
 
 
+def station_digest_report(data):
+    """Acknowledges a report giving only the digest of a station's inventory
+    (as returned for its last full report), if that is the digest of the
+    inventory last reported for the station. Otherwise, the failure returned
+    is marked 'stale' and the inventory should be reported in full.
+    """
+    form = StationDigestForm(data)
+    if not form.is_valid():
+        return validation_error_response('Station', form)
+
+    station_id = form.cleaned_data['station_id']
+    current = Station.objects.filter(station_id=station_id, inventory_digest=form.cleaned_data['digest'])
+    if not current.exists():
+        return JsonResponse({'result': 'failure', 'error': 'Inventory has changed', 'stale': True})
+
+    # The prices reported are those last reported in full.
+    prices = SaleItem.objects.filter(station__station_id=station_id).values_list('item__item_id', 'price')
+    history.record(station_id, dict(prices))
+
+    return JsonResponse({'result': 'success', 'digest': form.cleaned_data['digest'], 'unchanged': True})
+
+
 @require_http_methods(['POST'])
-@transaction.commit_on_success
 def station_report(request):
+    """Records the inventory of a station. Reports may instead give only the
+    digest of an unchanged inventory (see `station_digest_report`).
+    """
     try:
         data = json.loads(request.POST['data'])
     except:
         return HttpResponseBadRequest('Missing or invalid JSON in POST data')
 
-    # Save faction
+    if 'items' not in data and 'digest' in data:
+        return station_digest_report(data)
+
+    # Validate everything before writing anything
     faction_form = FactionForm(data)
     if not faction_form.is_valid():
         return validation_error_response('Faction', faction_form)
 
-    faction, created = Faction.objects.get_or_create(**faction_form.cleaned_data)
-
-    # Save station
     station_form = StationForm(data)
     if not station_form.is_valid():
         return validation_error_response('Station', station_form)
 
-    station, created = Station.objects.get_or_create(faction=faction, **station_form.cleaned_data)
-
-    # Save each item and sale item for the station
+    items = dict()
     for item_data in data['items']:
         # Create a label for errors in this item's data
         label = 'Item'
@@ -53,81 +100,275 @@ def station_report(request):
         if not item_form.is_valid():
             return validation_error_response(label, item_form)
 
-        item, created = Item.objects.get_or_create(**item_form.cleaned_data)
-
         sale_form = SaleItemForm(item_data)
         if not sale_form.is_valid():
             return validation_error_response(label, sale_form)
 
-        sale, created = SaleItem.objects.get_or_create(item=item, station=station, **sale_form.cleaned_data)
+        item = item_form.cleaned_data
+        items[item['item_id']] = (item['item_name'], item['volume'], sale_form.cleaned_data['price'])
+
+    with transaction.commit_on_success():
+        # Save faction and station
+        faction, created = Faction.objects.get_or_create(**faction_form.cleaned_data)
+        station, created = Station.objects.get_or_create(faction=faction, **station_form.cleaned_data)
+
+        # Save the station's items and sale items, unless they are unchanged
+        digest = inventory_digest(items)
+        unchanged = station.inventory_digest == digest
+        if not unchanged:
+            changes = apply_inventory(station, items)
+            Station.objects.filter(pk=station.pk).update(inventory_digest=digest)
+
+    history.record(station.station_id, dict((k, price) for k, (_, _, price) in items.iteritems()))
+
+    if unchanged:
+        return JsonResponse({'result': 'success', 'digest': digest, 'unchanged': True})
+
+    index.apply(changes)
+    trade.apply(changes)
+
+    return JsonResponse({'result': 'success', 'digest': digest})
+
 
-    return JsonResponse({'result': 'success'})
+def result_limit(data):
+    """Returns the number of locations asked for by 'limit' in `data`, or
+    DEFAULT_LIMIT, up to MAX_LIMIT.
+    """
+    try:
+        limit = int(data.get('limit', DEFAULT_LIMIT))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid "limit"')
+
+    if limit < 1:
+        raise ValueError('Invalid "limit"')
+    return min(limit, MAX_LIMIT)
 
 
-def sale_locations(data):
+def indexed_items(sales, data):
+    """Returns the name of the items named by 'item' in `data`, as found in
+    SaleIndex `sales`, along with their primary keys. An item that is not
+    found by name may be found by the one name similar to it (see
+    `NameIndex.resolve`); otherwise, ItemNotFound is raised.
+    """
     if 'item' not in data:
         raise ValueError('Missing "item"')
 
-    item = Item.objects.filter(item_name__iexact=data['item'])
-    if not item:
-        raise ValueError('Item not found')
+    if not isinstance(data['item'], basestring):
+        raise ValueError('Invalid "item"')
+
+    name, items = sales.names.resolve(data['item'])
+    if not items:
+        raise ItemNotFound(sales.names.similar(data['item'], SUGGESTIONS))
+
+    return name, items
+
+
+def item_not_found_response(error):
+    return JsonResponse({'result': 'failure', 'error': str(error), 'suggestions': error.suggestions})
 
-    return SaleItem.objects.filter(item__in=item)
+
+def start_system(data):
+    """Returns the system id given by 'sid' in `data`.
+    """
+    sid = data.get('sid')
+    if not isinstance(sid, int) or not 0 < sid < len(SYSTEM_NAMES) or SYSTEM_NAMES[sid] is None:
+        raise ValueError('Start system not found')
+    return sid
+
+
+def query_options(data):
+    """Returns the 'max_jumps' (None for any number) and 'weight' (credits
+    per jump, 0 by default) given in `data`.
+    """
+    max_jumps = data.get('max_jumps')
+    if max_jumps is not None:
+        try:
+            max_jumps = int(max_jumps)
+        except (TypeError, ValueError):
+            raise ValueError('Invalid "max_jumps"')
+        if max_jumps < 0:
+            raise ValueError('Invalid "max_jumps"')
+
+    try:
+        weight = float(data.get('weight', 0))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid "weight"')
+    if not weight >= 0:
+        raise ValueError('Invalid "weight"')
+
+    return max_jumps, weight
 
 
 @require_http_methods(['GET'])
 def nearest_sale_locations(request):
+    """Returns the `limit` locations selling an item that are the fewest jumps
+    from system 'sid', cheapest first among those as far away.
+    """
     try:
         data = json.loads(request.GET['data'])
     except:
         return HttpResponseBadRequest('Missing or invalid JSON in POST data')
 
+    sales = index.index()
+
     try:
-        start = short_system_name(SYSTEM_NAMES[data['sid']])
+        sid = start_system(data)
+        limit = result_limit(data)
+        name, items = indexed_items(sales, data)
+    except ItemNotFound, e:
+        return item_not_found_response(e)
+    except ValueError, e:
+        return JsonResponse({'result': 'failure', 'error': str(e)})
+
+    return JsonResponse({
+        'result': 'success',
+        'item': name,
+        'locations': [r.description for r in query.nearest(sales, items, sid, limit)],
+    })
+
+
+@require_http_methods(['GET'])
+def cheapest_sale_locations(request):
+    """Returns the `limit` cheapest locations selling an item. If system 'sid'
+    is given, only locations within 'max_jumps' of it are returned, and each
+    jump to a location adds 'weight' credits to its price when ranking them.
+    """
+    try:
+        data = json.loads(request.GET['data'])
     except:
-        return JsonResponse({'result': 'failure', 'error': 'Start system not found'})
+        return HttpResponseBadRequest('Missing or invalid JSON in POST data')
+
+    sales = index.index()
 
     try:
-        sales = sale_locations(data)
+        limit = result_limit(data)
+        name, items = indexed_items(sales, data)
+
+        if 'sid' in data:
+            sid = start_system(data)
+            max_jumps, weight = query_options(data)
+    except ItemNotFound, e:
+        return item_not_found_response(e)
     except ValueError, e:
         return JsonResponse({'result': 'failure', 'error': str(e)})
 
-    min_hops = None
-    results = []
+    if 'sid' in data:
+        results = query.cheapest_within(sales, items, sid, max_jumps, limit, weight)
+        locations = [repr(r) for r in results]
+    else:
+        locations = sales.cheapest(items, limit)
 
-    for sale in sales:
-        plans = shortest_jump_plans(start, sale.station.short_system())
-        hops = len(plans[0])
+    return JsonResponse({
+        'result': 'success',
+        'item': name,
+        'locations': locations,
+    })
 
-        if min_hops is None or hops < min_hops:
-            min_hops = hops
-            results = [sale]
-        elif hops == min_hops:
-            results.append(sale)
 
-    results = sorted(results, key=lambda r: r.price)
+@require_http_methods(['GET'])
+def trade_routes(request):
+    """Returns the `limit` (at most `trade.RUNS_PER_ITEM`) most profitable
+    trade runs, buying an item at one station and selling it at another, by
+    profit per cu of cargo per jump.
+    """
+    try:
+        data = json.loads(request.GET.get('data', '{}'))
+    except:
+        return HttpResponseBadRequest('Invalid JSON in GET data')
+
+    try:
+        limit = result_limit(data)
+    except ValueError, e:
+        return JsonResponse({'result': 'failure', 'error': str(e)})
 
+    try:
+        routes = trade.matrix()
+    except ImportError, e:
+        return JsonResponse({'result': 'failure', 'error': str(e)})
+
+    sales = index.index()
     return JsonResponse({
         'result': 'success',
-        'locations': [str(s) for s in results],
+        'routes': [trade.describe(sales, run) for run in routes.best(limit)],
     })
 
 
+def history_options(data):
+    """Returns the 'station_id' (None for all stations), 'period' (a rollup
+    period, 'day' by default, or 'samples' for every sample at a station),
+    'start' and 'end' (in seconds since the epoch) given in `data`.
+    """
+    station = data.get('station_id')
+    if station is not None and not isinstance(station, int):
+        raise ValueError('Invalid "station_id"')
+
+    period = data.get('period', 'day')
+    if period != 'samples' and period not in history.PERIODS:
+        raise ValueError('Invalid "period"')
+    if period == 'samples' and station is None:
+        raise ValueError('Missing "station_id"')
+
+    try:
+        start = int(data.get('start', 0))
+        end = int(data.get('end', time.time()))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid "start" or "end"')
+
+    return station, period, start, end
+
+
 @require_http_methods(['GET'])
-def cheapest_sale_locations(request):
+def price_history(request):
+    """Returns the prices of an item from 'start' to 'end', at station
+    'station_id' or across all stations, as the lowest, highest and average
+    price in each hour or day of 'period', or as every sample taken.
+    """
     try:
         data = json.loads(request.GET['data'])
     except:
-        return HttpResponseBadRequest('Missing or invalid JSON in POST data')
+        return HttpResponseBadRequest('Missing or invalid JSON in GET data')
 
     try:
-        sales = sale_locations(data)
+        name, items = indexed_items(index.index(), data)
+        station, period, start, end = history_options(data)
+    except ItemNotFound, e:
+        return item_not_found_response(e)
     except ValueError, e:
         return JsonResponse({'result': 'failure', 'error': str(e)})
 
-    sales = sales.order_by('price')
+    prices = []
+    for item in Item.objects.filter(pk__in=items):
+        if period == 'samples':
+            found = history.HISTORY.samples(item.item_id, station, start, end)
+        else:
+            found = history.HISTORY.rollup(item.item_id, station, period, start, end)
+        prices.append({'item': repr(item), 'prices': found})
+
+    return JsonResponse({
+        'result': 'success',
+        'item': name,
+        'history': prices,
+    })
+
+
+@require_http_methods(['GET'])
+def item_names(request):
+    """Returns up to `limit` item names starting with 'text', followed by
+    those most similar to it.
+    """
+    try:
+        data = json.loads(request.GET['data'])
+    except:
+        return HttpResponseBadRequest('Missing or invalid JSON in GET data')
+
+    try:
+        limit = result_limit(data)
+        if not isinstance(data.get('text'), basestring):
+            raise ValueError('Missing or invalid "text"')
+    except ValueError, e:
+        return JsonResponse({'result': 'failure', 'error': str(e)})
 
     return JsonResponse({
         'result': 'success',
-        'locations': [str(s) for s in sales[:6]],
+        'names': index.index().names.complete(data['text'], limit),
     })
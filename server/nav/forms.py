@@ -4,5 +4,12 @@ from vo.nav.models import IonStorm
 
 
 class IonStormForm(forms.ModelForm):
+    """Validates the location of a sector report.
+    """
     class Meta:
         model = IonStorm
+
+    def validate_unique(self):
+        # Reports are written as upserts, so reporting a sector that already
+        # has a storm is not an error.
+        pass
@@ -0,0 +1,205 @@
+"""
+vo.nav.hazards
+
+Keeps a process-local snapshot of reported ion storms and obstacles so that
+navigation requests do not need to query for them. The snapshot is reloaded
+the first time it is read after `invalidate` is called or reports buffered by
+`vo.nav.reports` are written, after the oldest storm in it goes stale, or once
+it is TTL seconds old. Reports still in the buffer are overlaid on what was
+loaded. Reports handled by other processes are seen once they have been
+written and the snapshot is next reloaded: within TTL seconds plus their
+buffer's FLUSH_INTERVAL.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.utils.timezone import now
+
+from vo.nav import reports
+from vo.nav.models import IonStorm, Obstacle
+from vo.util.info import SYSTEM_NAMES, short_system_name
+from vo.util.nav import SectorSet
+
+
+"""
+Number of seconds the snapshot is used for before it is loaded again, to see
+the reports written by other processes.
+"""
+TTL = getattr(settings, 'NAV_HAZARD_TTL', 5)
+
+
+class SystemHazards(object):
+    """The storms and obstacles in a single system, each as a bitboard (see
+    `vo.util.nav.SectorSet`), along with the snapshot version in which they
+    last changed.
+    """
+    def __init__(self, system, storms, obstacles, version):
+        self.system = system
+        self.storms = storms
+        self.obstacles = obstacles
+        self.version = version
+
+    def __eq__(self, other):
+        return self.storms == other.storms and self.obstacles == other.obstacles
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class HazardSnapshot(object):
+    """An immutable view of every hazard known at one point in time. Versions
+    increase monotonically; each system's version is the snapshot version in
+    which that system's hazards last changed.
+    """
+    def __init__(self, version, systems, expires):
+        self.version = version
+        self.systems = systems
+        self.expires = expires
+
+        self.storms = SectorSet.from_masks(
+            dict((s, h.storms) for s, h in systems.iteritems()))
+        self.obstacles = SectorSet.from_masks(
+            dict((s, h.obstacles) for s, h in systems.iteritems()))
+        self.all_sectors = self.storms | self.obstacles
+        self.storm_ids = sorted(s.sector_id() for s in self.storms)
+
+    def system_version(self, system):
+        """Returns the version in which hazards in `system` last changed.
+        """
+        hazards = self.systems.get(system)
+        if hazards is None:
+            return 0
+        return hazards.version
+
+    def is_stale(self, when):
+        """Returns True if a storm in the snapshot has expired by `when`.
+        """
+        return self.expires is not None and when >= self.expires
+
+
+_SYSTEMS = dict((sid, short_system_name(name))
+                for sid, name in enumerate(SYSTEM_NAMES) if name is not None)
+
+_lock = threading.Lock()
+_snapshot = None
+_loaded = None
+_expires = None
+_dirty = True
+_written = None
+_pending = None
+
+
+def invalidate():
+    """Marks the current snapshot out of date. Must be called after a change
+    to IonStorm or Obstacle made other than through `vo.nav.reports` has been
+    committed.
+    """
+    global _dirty
+    _dirty = True
+
+
+def snapshot():
+    """Returns the current HazardSnapshot, reloading it if it has been
+    invalidated, buffered reports have been written, a storm in it has
+    expired or it is older than TTL, and rebuilding it if the buffered
+    reports have changed.
+    """
+    global _snapshot, _loaded, _expires, _dirty, _written, _pending
+
+    with _lock:
+        current = now()
+        written = reports.BUFFER.written
+        reload = (_loaded is None or _dirty or written != _written or
+                  time.time() >= _expires or _snapshot.is_stale(current))
+
+        if reload:
+            # Cleared before querying, so that a report committed while the
+            # snapshot is being loaded causes another reload.
+            _dirty = False
+            try:
+                _loaded = load(current)
+            except:
+                _dirty = True
+                raise
+            _expires = time.time() + TTL
+            _written = written
+
+        version, pending = reports.BUFFER.pending()
+        if reload or version != _pending:
+            storms, obstacles, expires = _loaded
+            storms, obstacles = overlay(storms, obstacles, pending)
+            _snapshot = build(_snapshot, storms, obstacles, expires)
+            _pending = version
+
+        return _snapshot
+
+
+def load(when):
+    """Loads the storms and obstacles from the database as of `when`. Returns
+    dictionaries of system => bitboard for each, and the time the oldest
+    storm loaded expires.
+    """
+    storms = dict()
+    obstacles = dict()
+    expires = None
+
+    stale = when - IonStorm.MAX_DURATION
+    rows = IonStorm.objects.filter(reported__gte=stale).values_list('sid', 'x', 'y', 'reported')
+    for sid, x, y, reported in rows:
+        system = _SYSTEMS[sid]
+        storms[system] = storms.get(system, 0) | 1 << (y * 16 + x)
+        if expires is None or reported < expires:
+            expires = reported
+
+    if expires is not None:
+        expires += IonStorm.MAX_DURATION
+
+    for sid, x, y in Obstacle.objects.values_list('sid', 'x', 'y'):
+        system = _SYSTEMS[sid]
+        obstacles[system] = obstacles.get(system, 0) | 1 << (y * 16 + x)
+
+    return storms, obstacles, expires
+
+
+def overlay(storms, obstacles, pending):
+    """Returns copies of the `storms` and `obstacles` bitboards with the
+    (sid, x, y) => (has_storm, has_obstacles, observed) reports in `pending`
+    applied.
+    """
+    storms = dict(storms)
+    obstacles = dict(obstacles)
+
+    for (sid, x, y), (has_storm, has_obstacles, _) in pending.iteritems():
+        system = _SYSTEMS[sid]
+        bit = 1 << (y * 16 + x)
+        for masks, present in ((storms, has_storm), (obstacles, has_obstacles)):
+            if present:
+                masks[system] = masks.get(system, 0) | bit
+            elif system in masks:
+                masks[system] &= ~bit
+
+    return storms, obstacles
+
+
+def build(previous, storms, obstacles, expires):
+    """Builds a HazardSnapshot of the `storms` and `obstacles` bitboards,
+    carrying forward the version of every system unchanged since `previous`.
+    """
+    version = 1
+    names = set(storms) | set(obstacles)
+    if previous is not None:
+        version = previous.version + 1
+        names |= set(previous.systems)
+
+    systems = dict()
+    for system in names:
+        hazards = SystemHazards(system, storms.get(system, 0), obstacles.get(system, 0), version)
+
+        if previous is not None and system in previous.systems:
+            if previous.systems[system] == hazards:
+                hazards = previous.systems[system]
+
+        systems[system] = hazards
+
+    return HazardSnapshot(version, systems, expires)
@@ -3,21 +3,14 @@ import datetime
 from django.db import models
 from django.utils.timezone import now
 
-from vo.util.info import SYSTEM_NAMES, short_system_name
-from vo.util.models import AbstractSector
-from vo.util.nav import Sector, Point
+from vo.util.models import AbstractSector, SectorManager
 
 
-class IonStormManager(models.Manager):
+class IonStormManager(SectorManager):
     def sectors(self):
-        def sector(storm):
-            point = Point(storm.x, storm.y)
-            system = short_system_name(SYSTEM_NAMES[storm.sid])
-            return Sector(system, point)
-
         stale = now() - IonStorm.MAX_DURATION
         storms = super(IonStormManager, self).get_query_set().filter(reported__gte=stale)
-        return set(sector(s) for s in storms)
+        return set(s.sector() for s in storms)
 
 
 class IonStorm(AbstractSector):
@@ -29,7 +22,7 @@ class IonStorm(AbstractSector):
 
     objects = IonStormManager()
 
-    class Meta:
+    class Meta(AbstractSector.Meta):
         ordering = ('-reported', 'sid', 'x', 'y')
 
     def __unicode__(self):
@@ -37,15 +30,10 @@ class IonStorm(AbstractSector):
         return '%s reported at %s' % (sector, self.reported)
 
 
-class ObstacleManager(models.Manager):
+class ObstacleManager(SectorManager):
     def sectors(self):
-        def sector(s):
-            point = Point(s.x, s.y)
-            system = short_system_name(SYSTEM_NAMES[s.sid])
-            return Sector(system, point)
-
         sectors = super(ObstacleManager, self).get_query_set().all()
-        return set(sector(s) for s in sectors)
+        return set(s.sector() for s in sectors)
 
 
 class Obstacle(AbstractSector):
@@ -0,0 +1,168 @@
+"""
+vo.nav.reports
+
+Buffers sector reports before they are written, since clients report every
+sector they enter and popular sectors are reported many times over. Only the
+latest observation of each sector is kept, and the buffer is written in a single
+transaction once it holds FLUSH_SIZE sectors or FLUSH_INTERVAL seconds after
+the first report into it. Reports are lost if the process dies first.
+
+Buffered reports are overlaid on the hazard snapshot (see `vo.nav.hazards`),
+so they are seen by navigation requests in this process at once.
+"""
+import atexit
+import operator
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.timezone import now
+
+from vo.nav.models import IonStorm, Obstacle
+
+
+"""
+Number of sectors buffered before the buffer is written, and the longest
+time in seconds a report is buffered for. A FLUSH_SIZE of 1 writes every
+report as it is made.
+"""
+FLUSH_SIZE = getattr(settings, 'NAV_REPORT_FLUSH_SIZE', 200)
+FLUSH_INTERVAL = getattr(settings, 'NAV_REPORT_FLUSH_INTERVAL', 2.0)
+
+"""
+Number of sectors matched by a single query when writing, keeping within the
+limit on query parameters of SQLite.
+"""
+WRITE_CHUNK = 100
+
+
+class ReportBuffer(object):
+    """Reports waiting to be written, as (sid, x, y) => (has_storm,
+    has_obstacles, observed). `version` changes whenever the pending reports
+    do, and `written` counts the writes committed.
+    """
+    def __init__(self, size, interval):
+        self.size = size
+        self.interval = interval
+        self.reports = OrderedDict()
+        self.writing = dict()
+        self.version = 0
+        self.written = 0
+        self.timer = None
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+
+    def add(self, sid, x, y, has_storm, has_obstacles, observed=None):
+        """Buffers a report for a sector observed at `observed` (by default,
+        now), and writes the buffer if it is full.
+        """
+        self.extend([(sid, x, y, has_storm, has_obstacles, observed or now())])
+
+    def extend(self, reports):
+        """Buffers a list of (sid, x, y, has_storm, has_obstacles, observed)
+        reports, keeping only the latest observed for each sector, and writes
+        the buffer if it is full.
+        """
+        with self.lock:
+            for sid, x, y, has_storm, has_obstacles, observed in reports:
+                key = (sid, x, y)
+                previous = self.reports.pop(key, None)
+                if previous is not None and previous[2] > observed:
+                    self.reports[key] = previous
+                else:
+                    self.reports[key] = (has_storm, has_obstacles, observed)
+            self.version += 1
+
+            full = len(self.reports) >= self.size
+            if not full and self.timer is None:
+                self.timer = threading.Timer(self.interval, self._flush_later)
+                self.timer.daemon = True
+                self.timer.start()
+
+        if full:
+            self.flush()
+
+    def pending(self):
+        """Returns the version of the pending reports along with a dictionary
+        of them, including those being written.
+        """
+        with self.lock:
+            reports = dict(self.writing)
+            reports.update(self.reports)
+            return self.version, reports
+
+    def flush(self):
+        """Writes every buffered report in one transaction. If the write
+        fails, the reports are buffered again unless newer ones have been
+        made for the same sectors.
+        """
+        with self.write_lock:
+            with self.lock:
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+
+                reports = self.reports
+                if not reports:
+                    return
+                self.reports = OrderedDict()
+                self.writing = dict(reports)
+
+            try:
+                write(reports)
+            except:
+                with self.lock:
+                    for key, report in reports.iteritems():
+                        self.reports.setdefault(key, report)
+                    self.writing = dict()
+                    self.version += 1
+                raise
+
+            with self.lock:
+                self.written += 1
+                self.writing = dict()
+                self.version += 1
+
+    def _flush_later(self):
+        try:
+            self.flush()
+        finally:
+            connection.close()
+
+
+BUFFER = ReportBuffer(FLUSH_SIZE, FLUSH_INTERVAL)
+
+atexit.register(BUFFER.flush)
+
+
+def write(reports):
+    """Applies a dictionary of (sid, x, y) => (has_storm, has_obstacles,
+    observed) reports to IonStorm and Obstacle in one transaction. Storms are
+    marked as reported when observed, unless reported later already, and are
+    only removed by reports observed no earlier than they were reported.
+    """
+    storms = dict()
+    calm = []
+    obstacles = dict()
+    clear = []
+
+    for key, (has_storm, has_obstacles, observed) in reports.iteritems():
+        if has_storm:
+            storms[key] = {'reported': observed}
+        else:
+            calm.append(Q(sid=key[0], x=key[1], y=key[2], reported__lte=observed))
+
+        if has_obstacles:
+            obstacles[key] = {}
+        else:
+            clear.append(Q(sid=key[0], x=key[1], y=key[2]))
+
+    with transaction.commit_on_success():
+        IonStorm.objects.upsert(storms, latest='reported')
+        Obstacle.objects.upsert(obstacles)
+
+        for model, conditions in ((IonStorm, calm), (Obstacle, clear)):
+            for i in xrange(0, len(conditions), WRITE_CHUNK):
+                model.objects.filter(reduce(operator.or_, conditions[i:i + WRITE_CHUNK])).delete()
@@ -0,0 +1,221 @@
+"""
+vo.nav.routing
+
+Plans routes for the navigation views against a HazardSnapshot, caching the
+route for each leg. A cached leg is reused only while every system it
+depends on has the same hazard version it was planned with, so a report in
+one system does not discard routes elsewhere.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from vo.util.info import SYSTEM_NAMES, sector_id
+from vo.util.nav import (Budget, Sector, SectorSet, navigate, plan_route,
+                         plan_universe_route, shortest_jump_plan)
+
+
+"""
+Strategies that also avoid crossing obstacles, and the strategies that plan
+each leg across every system at once rather than fixing the series of system
+jumps first.
+"""
+SAFE_STRATEGIES = ('safe', 'global')
+GLOBAL_STRATEGIES = ('global',)
+
+
+"""
+The work allowed for planning each plotted route, as a number of node
+expansions and a number of seconds (None for no limit). When either runs out,
+the best route found so far is returned and marked as not optimal. The time
+limit should be well within NAV_PLOT_TIMEOUT (see `vo.nav.workers`).
+"""
+PLOT_EXPANSIONS = getattr(settings, 'NAV_PLOT_EXPANSIONS', None)
+PLOT_SECONDS = getattr(settings, 'NAV_PLOT_SECONDS', 2.0)
+
+"""
+Number of seconds allowed for planning every route in one batch, shared
+between them. Routes not reached in time are not planned. This should also
+be well within NAV_PLOT_TIMEOUT.
+"""
+PLOT_BATCH_SECONDS = getattr(settings, 'NAV_PLOT_BATCH_SECONDS', 4.0)
+
+
+class RouteCache(object):
+    """A least-recently-used cache of planned legs, bounded by the total
+    number of sectors held and expiring entries after `ttl` seconds.
+    """
+    def __init__(self, max_sectors, ttl):
+        self.max_sectors = max_sectors
+        self.ttl = ttl
+        self.sectors = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, snapshot):
+        """Returns the cached route for `key`, or None if there is none or it
+        depends on a system whose hazards have changed since.
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                expires, versions, route = entry
+                current = all(snapshot.system_version(s) == v for s, v in versions)
+                if current and expires > time.time():
+                    self.entries[key] = entry
+                    self.hits += 1
+                    return route
+
+                self.sectors -= len(route)
+
+            self.misses += 1
+
+    def set(self, key, snapshot, systems, route):
+        """Caches `route` for `key`, valid while the hazard version of every
+        system in `systems` is unchanged from `snapshot`.
+        """
+        if len(route) > self.max_sectors:
+            return
+
+        versions = tuple((s, snapshot.system_version(s)) for s in systems)
+        entry = (time.time() + self.ttl, versions, route)
+
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.sectors -= len(previous[2])
+
+            self.entries[key] = entry
+            self.sectors += len(route)
+
+            while self.sectors > self.max_sectors:
+                _, (_, _, evicted) = self.entries.popitem(last=False)
+                self.sectors -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.sectors = 0
+
+    def stats(self):
+        """Returns a dictionary of the cache's counters and size.
+        """
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'sectors': self.sectors,
+            }
+
+
+ROUTE_CACHE = RouteCache(
+    getattr(settings, 'NAV_ROUTE_CACHE_SECTORS', 100000),
+    getattr(settings, 'NAV_ROUTE_CACHE_TTL', 3600))
+
+
+def sector(sid, x, y):
+    """Returns the Sector for a system id and integral x, y coordinates.
+    Raises ValueError if there is no such sector.
+    """
+    for value in (sid, x, y):
+        if not isinstance(value, (int, long)) or isinstance(value, bool):
+            raise ValueError('sector coordinates must be integers')
+
+    if not 0 < sid < len(SYSTEM_NAMES) or SYSTEM_NAMES[sid] is None:
+        raise ValueError('unknown system id: %d' % sid)
+
+    if not (0 <= x < 16 and 0 <= y < 16):
+        raise ValueError('sector out of range: %d, %d' % (x, y))
+
+    return Sector.from_id(sector_id(sid, x, y))
+
+
+def plan(route, strategy, snapshot, cache=ROUTE_CACHE, budget=None):
+    """Plans a series of safe jumps through `route`, a list of (sid, x, y)
+    waypoints, using the hazards in `snapshot` as `strategy` dictates. Returns
+    a list of Sectors, which is empty if there is no possible route (or none
+    was found within `budget`). Legs cut short by the budget are not cached.
+    """
+    avoid = snapshot.storms
+    obstacles = SectorSet()
+
+    if strategy in SAFE_STRATEGIES:
+        obstacles = snapshot.obstacles
+        avoid = snapshot.all_sectors
+
+    router = plan_route
+    if strategy in GLOBAL_STRATEGIES:
+        router = plan_universe_route
+
+    # Strategies that plan alike share cached legs.
+    mode = (strategy in SAFE_STRATEGIES, strategy in GLOBAL_STRATEGIES)
+
+    waypoints = [sector(*s) for s in route]
+
+    # navigate exempts every waypoint from the hazards for every leg, so any
+    # waypoints that are hazards are part of each leg's key.
+    exempt = tuple(sorted(w.sector_id() for w in set(waypoints) if w in avoid))
+
+    def _router(start, end, avoid, obstacles, budget=None):
+        key = (start.sector_id(), end.sector_id(), mode, exempt)
+        leg = cache.get(key, snapshot)
+        if leg is None:
+            leg = router(start, end, avoid, obstacles, budget)
+            if leg and (budget is None or budget.optimal):
+                # Routes through other systems would only be preferred if
+                # those on a shortest series of jumps became blocked.
+                systems = set(s.system for s in leg)
+                systems.update(shortest_jump_plan(start.system, end.system))
+                cache.set(key, snapshot, sorted(systems), leg)
+        return leg
+
+    return navigate(waypoints, avoid, obstacles, _router, budget)
+
+
+def plot_result(route, strategy, snapshot, batch=None):
+    """Plans a route as `plan` does, within PLOT_EXPANSIONS and PLOT_SECONDS
+    (and the Budget `batch`, if given), and returns the result to send back
+    for it: the sector ids of the route and whether it is known to be
+    optimal, or the reason there is none.
+    """
+    budget = Budget(PLOT_EXPANSIONS, PLOT_SECONDS, batch)
+    try:
+        steps = plan(route, strategy, snapshot, budget=budget)
+    except (IndexError, KeyError, TypeError, ValueError):
+        return {'result': 'failure', 'error': 'Invalid route'}
+
+    if steps:
+        sectors = [s.sector_id() for s in steps]
+        return {'result': 'success', 'route': sectors, 'optimal': budget.optimal}
+    elif not budget.optimal:
+        return {'result': 'failure', 'error': 'No route found in time'}
+    else:
+        return {'result': 'failure', 'error': 'No possible route found'}
+
+
+def plot_results(requests, snapshot):
+    """Plans a list of (route, strategy) requests, or None for those that are
+    invalid, as `plot_result` does, all within PLOT_BATCH_SECONDS. Returns
+    the result to send back for each, in the order requested.
+    """
+    batch = Budget(seconds=PLOT_BATCH_SECONDS)
+    results = []
+
+    for request in requests:
+        if request is None:
+            results.append({'result': 'failure', 'error': 'Invalid route'})
+        elif batch.exhausted():
+            results.append({'result': 'failure', 'error': 'No route found in time'})
+        else:
+            route, strategy = request
+            results.append(plot_result(route, strategy, snapshot, batch))
+
+    return results
@@ -5,7 +5,23 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
-from django.test import TestCase
+import datetime
+import pickle
+import random
+import time
+
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.utils.timezone import now
+from django.utils.unittest import skipIf
+
+from vo.nav import hazards, routing, workers
+from vo.nav.models import IonStorm, Obstacle
+from vo.util import models
+from vo.util.info import WORMHOLE, sector_vochar2py
+from vo.util.nav import (Budget, JumpGraph, Path, Point, Sector, SectorSet, Segment,
+                         TransitTable, navigate, numpy, plan_route, plan_universe_route,
+                         segment_table, transit_table)
 
 
 class SimpleTest(TestCase):
@@ -14,3 +30,607 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class SegmentTableTest(SimpleTestCase):
+    def test_masks_match_walk(self):
+        """
+        Tests that every segment mask holds exactly the sectors walked by
+        Segment.walk, including 45 degree segments.
+        """
+        table = segment_table(16)
+        for start in xrange(0, 256):
+            for end in xrange(0, 256):
+                segment = Segment(Point(start % 16, start // 16),
+                                  Point(end % 16, end // 16))
+                mask = 0
+                for point in segment.walk():
+                    mask |= 1 << (point.y * 16 + point.x)
+                self.assertEqual(mask, table.mask(start, end))
+
+    def test_has_clear_path(self):
+        path = Path(16, Point(0, 0), Point(15, 15))
+        self.assertTrue(path.has_clear_path(Point(0, 0), Point(15, 15)))
+
+        path.add_avoidance(Point(7, 7))
+        self.assertFalse(path.has_clear_path(Point(0, 0), Point(15, 15)))
+        self.assertTrue(path.has_clear_path(Point(0, 1), Point(14, 15)))
+
+
+class FlyweightTest(SimpleTestCase):
+    def test_points(self):
+        """
+        Tests that every Point on the map is a single shared instance, even
+        once unpickled, and that Points off the map are still equal by value.
+        """
+        self.assertIs(Point(3, 4), Point(3, 4))
+        self.assertIs(pickle.loads(pickle.dumps(Point(3, 4))), Point(3, 4))
+        self.assertIsNot(Point(20, 1), Point(20, 1))
+        self.assertEqual(Point(20, 1), Point(20, 1))
+        self.assertEqual(hash(Point(20, 1)), hash(Point(20, 1)))
+
+    def test_sectors(self):
+        """
+        Tests that every Sector is a single shared instance, found by value
+        or by its sector id, and that unknown systems are refused.
+        """
+        sector = Sector('dau', Point(1, 2))
+        self.assertIs(Sector('dau', Point(1, 2)), sector)
+        self.assertIs(Sector.from_id(sector.sector_id()), sector)
+        self.assertIs(pickle.loads(pickle.dumps(sector)), sector)
+        self.assertNotEqual(Sector('arta', Point(1, 2)), sector)
+        self.assertRaises(ValueError, Sector, 'nowhere', Point(1, 2))
+        self.assertRaises(ValueError, Sector.from_id, 0)
+
+
+class SectorSetTest(SimpleTestCase):
+    def test_matches_set(self):
+        """
+        Tests that SectorSets hold, iterate and combine the same sectors as
+        built-in sets of Sectors.
+        """
+        rng = random.Random(5)
+        systems = sorted(WORMHOLE)[:4]
+
+        def sectors():
+            return set(Sector(rng.choice(systems), Point(rng.randrange(16), rng.randrange(16)))
+                       for _ in xrange(0, 60))
+
+        for _ in xrange(0, 20):
+            a = sectors()
+            b = sectors()
+            first = SectorSet(a)
+            second = SectorSet(b)
+
+            self.assertEqual(len(first), len(a))
+            self.assertEqual(set(first), a)
+            self.assertEqual(set(first | second), a | b)
+            self.assertEqual(set(first & second), a & b)
+            self.assertEqual(set(first - second), a - b)
+            self.assertEqual(first.systems(), set(s.system for s in a))
+
+            for sector in a | b:
+                self.assertEqual(sector in first, sector in a)
+
+            for sector in list(a)[:10]:
+                first.discard(sector)
+                self.assertNotIn(sector, first)
+            self.assertEqual(set(first), set(list(a)[10:]))
+
+    def test_system_mask(self):
+        sectors = SectorSet([Sector('dau', Point(1, 2)), Sector('dau', Point(0, 0))])
+        self.assertEqual(sectors.system_mask('dau'), 1 << 33 | 1)
+        self.assertEqual(sectors.system_mask('arta'), 0)
+        self.assertEqual(SectorSet.from_masks({'dau': 1 << 33 | 1, 'arta': 0}), sectors)
+
+
+class JumpGraphTest(SimpleTestCase):
+    def setUp(self):
+        self.graph = JumpGraph({
+            'a': set(['b', 'c']),
+            'b': set(['d']),
+            'c': set(['d', 'e']),
+            'd': set(['a']),
+            'e': set(['d']),
+            'f': set(),
+        })
+
+    def test_distances(self):
+        """
+        Tests that jump counts and shortest plans are read back for every
+        pair of systems, following jumps in their direction only.
+        """
+        self.assertEqual(self.graph.distance('a', 'd'), 2)
+        self.assertEqual(self.graph.distance('d', 'a'), 1)
+        self.assertEqual(self.graph.distance('a', 'f'), None)
+        self.assertEqual(self.graph.distances_from('a'), {'a': 0, 'b': 1, 'c': 1, 'd': 2, 'e': 2})
+        self.assertEqual(self.graph.plan('a', 'd'), ('a', 'b', 'd'))
+        self.assertEqual(self.graph.next_hop('a', 'e'), 'c')
+        self.assertEqual(self.graph.plan('a', 'f'), None)
+
+    def test_plans(self):
+        """
+        Tests that every shortest plan is found, and that every plan visiting
+        no system twice is found in order of length.
+        """
+        self.assertEqual(sorted(self.graph.plans_between('a', 'd')), [['a', 'b', 'd'], ['a', 'c', 'd']])
+        self.assertEqual(list(self.graph.iter_plans('a', 'd')),
+                         [['a', 'b', 'd'], ['a', 'c', 'd'], ['a', 'c', 'e', 'd']])
+        self.assertEqual(list(self.graph.iter_plans('f', 'a')), [])
+
+
+class TransitTableTest(SimpleTestCase):
+    def test_routes(self):
+        """
+        Tests that routes between every pair of wormholes in a system are
+        clear of hazards other than the two wormholes themselves.
+        """
+        table = segment_table(16)
+        rng = random.Random(11)
+        wormholes = [Point(x, y) for (x, y) in WORMHOLE['dau'].itervalues()]
+
+        avoid = 0
+        for _ in xrange(0, 40):
+            avoid |= 1 << rng.randrange(256)
+        for wormhole in wormholes:
+            avoid |= 1 << (wormhole.y * 16 + wormhole.x)
+
+        transit = TransitTable('dau', avoid, 0)
+        for start in wormholes:
+            for end in wormholes:
+                if start == end:
+                    continue
+
+                route = transit.route(start, end)
+                self.assertEqual(route[0], start)
+                self.assertEqual(route[-1], end)
+
+                exempt = ~(1 << (start.y * 16 + start.x) | 1 << (end.y * 16 + end.x))
+                for a, b in zip(route, route[1:]):
+                    self.assertFalse(table.mask(a.y * 16 + a.x, b.y * 16 + b.x) & avoid & exempt)
+
+    def test_cached_by_hazards(self):
+        """
+        Tests that a system's TransitTable is only built again once its
+        hazards change.
+        """
+        transit = transit_table('dau', 1 << 40, 0)
+        self.assertIs(transit_table('dau', 1 << 40, 0), transit)
+        self.assertIsNot(transit_table('dau', 1 << 41, 0), transit)
+
+
+class CalculatePathTest(SimpleTestCase):
+    def test_more_than_two_waypoints(self):
+        """
+        Tests that a route is found through walls that need six waypoints.
+        """
+        path = Path(16, Point(0, 0), Point(0, 12))
+        for x in xrange(0, 15):
+            path.add_avoidance(Point(x, 3))
+            path.add_avoidance(Point(x + 1, 6))
+            path.add_avoidance(Point(x, 9))
+
+        route = path.calculate_path()
+        self.assertEqual(len(route), 8)
+        self.assertEqual(route[0], Point(0, 0))
+        self.assertEqual(route[-1], Point(0, 12))
+
+        for start, end in zip(route, route[1:]):
+            self.assertTrue(path.has_clear_path(start, end))
+
+    def test_hazards(self):
+        """
+        Tests that hazards are read back as frozensets, which cannot be
+        added to, and that segments off the grid are never clear.
+        """
+        path = Path(16, Point(0, 0), Point(0, 12))
+        path.add_avoidance(Point(3, 3))
+        path.add_obstacle(Point(4, 4))
+
+        self.assertEqual(path.avoid, frozenset([Point(3, 3)]))
+        self.assertEqual(path.obstacles, frozenset([Point(4, 4)]))
+        self.assertRaises(AttributeError, lambda: path.avoid.add(Point(5, 5)))
+
+        self.assertTrue(path.has_clear_path(Point(0, 0), Point(0, 12)))
+        self.assertFalse(path.has_clear_path(Point(0, 0), Point(16, 3)))
+        self.assertFalse(path.has_clear_path(Point(-1, 0), Point(0, 12)))
+
+    def test_budget(self):
+        """
+        Tests that a search cut short by its budget still returns a clear
+        route and marks it as not optimal, and that an ample budget finds the
+        optimal route.
+        """
+        path = Path(16, Point(0, 0), Point(0, 12))
+        for x in xrange(0, 15):
+            path.add_avoidance(Point(x, 3))
+            path.add_avoidance(Point(x + 1, 6))
+            path.add_avoidance(Point(x, 9))
+
+        budget = Budget(expansions=150)
+        route = path.calculate_path(budget=budget)
+        self.assertFalse(budget.optimal)
+        self.assertEqual(route[0], Point(0, 0))
+        self.assertEqual(route[-1], Point(0, 12))
+        for start, end in zip(route, route[1:]):
+            self.assertTrue(path.has_clear_path(start, end))
+
+        budget = Budget(expansions=100000, seconds=60)
+        self.assertEqual(path.calculate_path(budget=budget), path.calculate_path())
+        self.assertTrue(budget.optimal)
+
+        shares = Budget(expansions=90).split(3)
+        self.assertEqual(shares.expansions, 30)
+        self.assertEqual(Budget(expansions=1).split(2).expansions, 1)
+
+
+class UniverseRouteTest(SimpleTestCase):
+    def sector(self, system, x, y):
+        return Sector(system, Point(*sector_vochar2py(x, y)))
+
+    def test_matches_plan_route(self):
+        """
+        Tests that the A* router crosses systems in as few steps as
+        plan_route, jumping through the wormholes it arrives at.
+        """
+        start = self.sector('dau', 'H', 8)
+        end = self.sector('ukari', 'H', 8)
+
+        route = plan_universe_route(start, end)
+        self.assertEqual(route[0], start)
+        self.assertEqual(route[-1], end)
+        self.assertEqual(len(route), len(plan_route(start, end)))
+        self.assertIn(self.sector('dau', 'B', 9), route)
+        self.assertIn(self.sector('arta', 'O', 12), route)
+
+    def test_storm_on_wormhole(self):
+        """
+        Tests that a storm on a wormhole sector is avoided by routes passing
+        through it, though the wormhole may still be jumped through.
+        """
+        storm = SectorSet([self.sector('dau', 'B', 9)])
+        start = self.sector('dau', 'A', 9)
+        end = self.sector('dau', 'C', 9)
+
+        expected = plan_route(start, end, storm)
+        self.assertEqual(len(expected), 3)
+        self.assertEqual(plan_universe_route(start, end, storm), expected)
+        self.assertNotIn(self.sector('dau', 'B', 9), expected)
+
+        route = plan_universe_route(start, self.sector('arta', 'C', 9), storm)
+        self.assertEqual(route[1:3], [self.sector('dau', 'B', 9), self.sector('arta', 'O', 12)])
+
+    def test_budget(self):
+        """
+        Tests that legs with a clear direct line are routed however little
+        budget is left, and that both routers return the best route found
+        when the budget runs out.
+        """
+        waypoints = [self.sector('dau', 'A', 9), self.sector('dau', 'C', 9),
+                     self.sector('dau', 'E', 9)]
+        for router in (plan_route, plan_universe_route):
+            budget = Budget(expansions=1)
+            self.assertEqual(navigate(waypoints, router=router, budget=budget), waypoints[1:])
+            self.assertTrue(budget.optimal)
+
+        start = self.sector('dau', 'H', 8)
+        end = self.sector('ukari', 'H', 8)
+        full = plan_universe_route(start, end)
+        for expansions in (5, 30, 200):
+            budget = Budget(expansions=expansions)
+            route = plan_universe_route(start, end, budget=budget)
+            self.assertEqual(route[0], start)
+            self.assertEqual(route[-1], end)
+            self.assertTrue(len(route) >= len(full))
+            if budget.optimal:
+                self.assertEqual(route, full)
+
+
+class PlotResultTest(SimpleTestCase):
+    def test_sector(self):
+        """
+        Tests that waypoints are looked up as the shared Sector instances,
+        by sector id.
+        """
+        sector = routing.sector(19, 1, 2)
+        self.assertIs(sector, Sector('dau', Point(1, 2)))
+        self.assertIs(Sector.from_id(sector.sector_id()), sector)
+
+    def test_invalid_routes(self):
+        """
+        Tests that routes through unknown systems or sectors are reported as
+        invalid rather than raising.
+        """
+        snapshot = hazards.build(None, {}, {}, None)
+        invalid = {'result': 'failure', 'error': 'Invalid route'}
+
+        for route in ([[0, 1, 1], [19, 2, 2]], [[19, 1, 1], [19, 2, 16]],
+                      [[31, 1, 1], [19, 2, 2]], [[19, 'a', 1], [19, 2, 2]],
+                      [[19, 1], [19, 2, 2]]):
+            self.assertEqual(routing.plot_result(route, 'safe', snapshot), invalid)
+
+        result = routing.plot_result([[19, 1, 1], [19, 2, 2]], 'safe', snapshot)
+        self.assertEqual(result['result'], 'success')
+
+
+class RouteCacheTest(SimpleTestCase):
+    def test_system_versions(self):
+        """
+        Tests that a change to the hazards of one system invalidates only the
+        cached routes through that system.
+        """
+        cache = routing.RouteCache(1000, 60)
+        before = hazards.build(None, {'dau': 1}, {'arta': 1}, None)
+        after = hazards.build(before, {'dau': 1, 'ukari': 1 << 40}, {'arta': 1}, None)
+
+        cache.set('dau', before, ['dau'], ['dau route'])
+        cache.set('arta', before, ['arta', 'dau'], ['arta route'])
+        cache.set('ukari', before, ['arta', 'ukari'], ['ukari route'])
+
+        self.assertEqual(cache.get('dau', after), ['dau route'])
+        self.assertEqual(cache.get('arta', after), ['arta route'])
+        self.assertEqual(cache.get('ukari', after), None)
+        self.assertEqual(cache.get('ukari', before), None)
+
+    def test_planned_routes(self):
+        """
+        Tests that routes planned through `routing.plan` are reused until a
+        storm is reported in a system they depend on.
+        """
+        cache = routing.RouteCache(1000, 60)
+        before = hazards.build(None, {}, {}, None)
+        after = hazards.build(before, {'ukari': 1 << 40}, {}, None)
+        dau = [[19, 1, 1], [19, 14, 14]]
+        azek = [[21, 1, 1], [21, 14, 14]]
+
+        for snapshot in (before, before, after):
+            routing.plan(dau, 'safe', snapshot, cache)
+            routing.plan(azek, 'safe', snapshot, cache)
+        self.assertEqual(cache.stats()['hits'], 4)
+
+        routing.plan([[19, 1, 1], [25, 1, 1]], 'safe', before, cache)
+        routing.plan([[19, 1, 1], [25, 1, 1]], 'safe', after, cache)
+        self.assertEqual(cache.stats()['hits'], 4)
+
+    def test_expiry(self):
+        cache = routing.RouteCache(1000, -1)
+        snapshot = hazards.build(None, {}, {}, None)
+        cache.set('key', snapshot, ['dau'], ['route'])
+        self.assertEqual(cache.get('key', snapshot), None)
+        self.assertEqual(cache.stats()['sectors'], 0)
+
+    def test_eviction(self):
+        """
+        Tests that the least recently used routes are evicted to keep within
+        the number of sectors held, and that routes larger than that are not
+        cached.
+        """
+        cache = routing.RouteCache(5, 60)
+        snapshot = hazards.build(None, {}, {}, None)
+
+        cache.set('a', snapshot, [], [1, 2])
+        cache.set('b', snapshot, [], [1, 2])
+        cache.get('a', snapshot)
+        cache.set('c', snapshot, [], [1, 2])
+
+        self.assertEqual(cache.get('b', snapshot), None)
+        self.assertEqual(cache.get('a', snapshot), [1, 2])
+        self.assertEqual(cache.get('c', snapshot), [1, 2])
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+        cache.set('d', snapshot, [], range(0, 6))
+        self.assertEqual(cache.get('d', snapshot), None)
+        self.assertEqual(cache.stats()['sectors'], 4)
+
+
+class PlannerPoolTest(SimpleTestCase):
+    def test_pending_in_process(self):
+        """
+        Tests that plans run in the calling process, before the pool is
+        started, are counted as pending and released when done.
+        """
+        snapshot = hazards.build(None, {}, {}, None)
+        pool = workers.PlannerPool(1, 1, 5.0)
+        route = [[19, 1, 1], [19, 2, 2]]
+
+        self.assertEqual(pool.plan(route, 'safe', snapshot)['result'], 'success')
+        self.assertEqual(pool.pending, 0)
+
+        pool.pending = 1
+        self.assertRaises(workers.Overloaded, pool.plan, route, 'safe', snapshot)
+
+    def test_expired_task(self):
+        """
+        Tests that a worker drops a task whose deadline passed while it was
+        queued, without planning it.
+        """
+        planned = []
+        snapshot = hazards.build(None, {}, {}, None)
+        pid, stats, result = workers._run(
+            lambda snapshot: planned.append(snapshot), (),
+            workers._payload(snapshot), time.time() - 1)
+
+        self.assertEqual(result, {'result': 'failure', 'error': 'Route plotting timed out'})
+        self.assertEqual(planned, [])
+
+
+class HazardOverlayTest(SimpleTestCase):
+    def test_overlay(self):
+        """
+        Tests that buffered reports add and clear storms and obstacles
+        without changing the bitboards they are overlaid on.
+        """
+        storms = {'dau': 1 << (3 * 16 + 3)}
+        obstacles = {'dau': 1 << (5 * 16 + 5)}
+        pending = {(19, 3, 3): (False, True, None), (19, 4, 4): (True, False, None)}
+
+        overlaid = hazards.overlay(storms, obstacles, pending)
+        self.assertEqual(overlaid, ({'dau': 1 << (4 * 16 + 4)},
+                                    {'dau': 1 << (3 * 16 + 3) | 1 << (5 * 16 + 5)}))
+        self.assertEqual(storms, {'dau': 1 << (3 * 16 + 3)})
+
+
+@skipIf(numpy is None, 'numpy is not installed')
+class EngineEquivalenceTest(SimpleTestCase):
+    def random_path(self, rng):
+        start = Point(rng.randrange(16), rng.randrange(16))
+        end = Point(rng.randrange(16), rng.randrange(16))
+        path = Path(16, start, end)
+
+        for _ in xrange(rng.randrange(0, 130)):
+            point = Point(rng.randrange(16), rng.randrange(16))
+            if point in (start, end):
+                continue
+
+            path.add_avoidance(point)
+            if rng.random() < 0.3:
+                path.add_obstacle(point)
+
+        return path
+
+    def assertValidRoute(self, path, route):
+        self.assertEqual(route[0], path.start)
+        self.assertEqual(route[-1], path.end)
+
+        for waypoint in route[1:-1]:
+            self.assertNotIn(waypoint, path.avoid)
+            self.assertNotIn(waypoint, path.obstacles)
+
+        for start, end in zip(route, route[1:]):
+            self.assertTrue(path.has_clear_path(start, end))
+
+    def test_engines_agree(self):
+        """
+        Tests that the bitboard and numpy engines find routes on the same
+        maps, with the same number of waypoints, and that both are clear.
+        """
+        rng = random.Random(7)
+        for _ in xrange(200):
+            path = self.random_path(rng)
+            bitboard = path.calculate_path(engine='bitboard')
+            vectorized = path.calculate_path(engine='numpy')
+
+            if bitboard is None:
+                self.assertIsNone(vectorized)
+                continue
+
+            self.assertEqual(len(bitboard), len(vectorized))
+            self.assertValidRoute(path, bitboard)
+            self.assertValidRoute(path, vectorized)
+
+    def test_budget(self):
+        """
+        Tests that the numpy engine returns a clear route when its budget
+        runs out, as the bitboard engine does.
+        """
+        path = Path(16, Point(0, 0), Point(0, 12), engine='numpy')
+        for x in xrange(0, 15):
+            path.add_avoidance(Point(x, 3))
+            path.add_avoidance(Point(x + 1, 6))
+            path.add_avoidance(Point(x, 9))
+
+        budget = Budget(expansions=150)
+        self.assertValidRoute(path, path.calculate_path(budget=budget))
+        self.assertFalse(budget.optimal)
+
+    def test_unknown_engine(self):
+        self.assertRaises(ValueError, Path, 16, Point(0, 0), Point(1, 1), 'abacus')
+
+
+class SectorUpsertTest(TestCase):
+    def setUp(self):
+        self.earlier = now() - datetime.timedelta(hours=1)
+        self.later = now()
+
+    def upsert(self, manager, rows, latest=None):
+        manager.upsert(rows, latest)
+
+    def reported(self):
+        return dict(((s.sid, s.x, s.y), s.reported) for s in IonStorm.objects.all())
+
+    def test_insert(self):
+        """
+        Tests that a row is created for each sector, in as many chunks as
+        needed.
+        """
+        rows = dict(((1, i % 16, i // 16), {'reported': self.earlier})
+                    for i in xrange(0, models.BULK_CHUNK + 5))
+        self.upsert(IonStorm.objects, rows, 'reported')
+        self.assertEqual(self.reported(), dict((k, self.earlier) for k in rows))
+
+    def test_update_when_newer(self):
+        """
+        Tests that an existing storm is only marked as reported later, never
+        earlier.
+        """
+        self.upsert(IonStorm.objects, {(1, 2, 3): {'reported': self.earlier}}, 'reported')
+        self.upsert(IonStorm.objects, {(1, 2, 3): {'reported': self.later}}, 'reported')
+        self.assertEqual(self.reported(), {(1, 2, 3): self.later})
+
+    def test_no_update_when_older(self):
+        self.upsert(IonStorm.objects, {(1, 2, 3): {'reported': self.later}}, 'reported')
+        self.upsert(IonStorm.objects, {(1, 2, 3): {'reported': self.earlier}}, 'reported')
+        self.assertEqual(self.reported(), {(1, 2, 3): self.later})
+
+    def test_no_fields(self):
+        """
+        Tests that sectors already holding obstacles are left as they are.
+        """
+        self.upsert(Obstacle.objects, {(1, 2, 3): {}})
+        pk = Obstacle.objects.get().pk
+
+        self.upsert(Obstacle.objects, {(1, 2, 3): {}, (1, 4, 5): {}})
+        self.assertEqual(Obstacle.objects.count(), 2)
+        self.assertEqual(Obstacle.objects.get(sid=1, x=2, y=3).pk, pk)
+
+
+class SectorUpsertRowsTest(SectorUpsertTest):
+    """Runs the SectorUpsertTest tests against the row by row upsert used by
+    databases without a single statement one, and for tables without a
+    unique index on the sector.
+    """
+    def upsert(self, manager, rows, latest=None):
+        key = (connection.alias, manager.model._meta.db_table)
+        models._sector_keys[key] = False
+        try:
+            manager.upsert(rows, latest)
+        finally:
+            del models._sector_keys[key]
+
+
+class SectorKeyTest(TestCase):
+    def test_unique_indexes(self):
+        """
+        Tests that the unique index on the sector is found, and that a table
+        without one is not taken to have it.
+        """
+        sector = frozenset(['sid', 'x', 'y'])
+        self.assertIn(sector, models.unique_indexes(connection, IonStorm._meta.db_table))
+        self.assertIn(sector, models.unique_indexes(connection, Obstacle._meta.db_table))
+
+        cursor = connection.cursor()
+        cursor.execute('CREATE TEMPORARY TABLE nav_unkeyed (id integer PRIMARY KEY, sid, x, y)')
+        try:
+            self.assertNotIn(sector, models.unique_indexes(connection, 'nav_unkeyed'))
+        finally:
+            cursor.execute('DROP TABLE nav_unkeyed')
+
+
+class BulkUpdateTest(TestCase):
+    def test_chunks(self):
+        """
+        Tests that every row is given its own values when they are written in
+        more than one chunk, and that other rows are left alone.
+        """
+        earlier = now() - datetime.timedelta(days=1)
+        IonStorm.objects.bulk_create(
+            [IonStorm(sid=1, x=i % 16, y=i // 16) for i in xrange(0, 2 * models.BULK_CHUNK + 5)])
+        storms = list(IonStorm.objects.order_by('pk'))
+        IonStorm.objects.update(reported=earlier)
+
+        rows = dict((s.pk, {'reported': earlier + datetime.timedelta(minutes=i)})
+                    for i, s in enumerate(storms[1:]))
+        models.bulk_update(IonStorm, rows)
+
+        for storm in IonStorm.objects.all():
+            self.assertEqual(storm.reported, rows.get(storm.pk, {'reported': earlier})['reported'])
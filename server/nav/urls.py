@@ -2,6 +2,9 @@ from django.conf.urls import patterns, url
 
 urlpatterns = patterns('',
     url(r'^sector_report/$', 'vo.nav.views.sector_report'),
+    url(r'^sector_report_batch/$', 'vo.nav.views.sector_report_batch'),
     url(r'^plot/$', 'vo.nav.views.plot'),
+    url(r'^plot_batch/$', 'vo.nav.views.plot_batch'),
     url(r'^storms/$', 'vo.nav.views.list_storms'),
+    url(r'^route_cache_stats/$', 'vo.nav.views.route_cache_stats'),
 )
@@ -1,18 +1,35 @@
+import datetime
 import json
 
-from django.db import transaction
+from django.conf import settings
 from django.http import HttpResponseBadRequest
+from django.utils.timezone import now
 from django.views.decorators.http import require_http_methods
 
-from vo.nav.models import IonStorm, Obstacle
+from vo.nav import hazards, reports, workers
 from vo.nav.forms import IonStormForm
-from vo.util.info import short_system_name, SYSTEM_NAMES
-from vo.util.nav import Point, Sector, navigate
 from vo.util import JsonResponse
 
 
+"""
+Maximum number of routes accepted by one request to `plot_batch`, and of
+observations accepted by one request to `sector_report_batch`.
+"""
+PLOT_BATCH_LIMIT = getattr(settings, 'NAV_PLOT_BATCH_LIMIT', 100)
+REPORT_BATCH_LIMIT = getattr(settings, 'NAV_REPORT_BATCH_LIMIT', 500)
+
+
+def form_errors(form):
+    """Returns a dictionary of field name => errors for an invalid form.
+    """
+    errors = dict()
+    for field in form:
+        if field.errors:
+            errors[field.name] = list(field.errors)
+    return errors
+
+
 @require_http_methods(['POST'])
-@transaction.commit_on_success
 def sector_report(request):
     try:
         data = json.loads(request.POST['data'])
@@ -21,45 +38,95 @@ def sector_report(request):
 
     form = IonStormForm(data)
     if form.is_valid():
-        if data['has_storm']:
-            storm, created = IonStorm.objects.get_or_create(**form.cleaned_data)
-            storm.save()
-        else:
-            try:
-                storm = IonStorm.objects.get(**form.cleaned_data)
-                storm.delete()
-            except IonStorm.DoesNotExist:
-                pass
-
-        if data['has_obstacles']:
-            obstacle, created = Obstacle.objects.get_or_create(**form.cleaned_data)
-            obstacle.save()
-        else:
-            try:
-                obstacle = Obstacle.objects.get(**form.cleaned_data)
-                obstacle.delete()
-            except Obstacle.DoesNotExist:
-                pass
+        sector = form.cleaned_data
+        reports.BUFFER.add(sector['sid'], sector['x'], sector['y'],
+                           bool(data['has_storm']), bool(data['has_obstacles']))
 
         result = {'result': 'success'}
     else:
-        errors = dict()
-        for field in form:
-            if field.errors:
-                errors[field] = field.errors
-
-        result = {'result': 'failure', 'errors': errors}
+        result = {'result': 'failure', 'errors': form_errors(form)}
 
     return JsonResponse(result)
 
 
-@require_http_methods(['GET'])
-def plot(request):
+def observed_at(age):
+    """Returns the time of an observation made `age` seconds ago (as measured
+    by the reporting client's clock), or now if that is not given or is in
+    the future. Ages, unlike times, do not depend on the client's clock being
+    set correctly.
+    """
+    current = now()
+    if age is None:
+        return current
+
+    age = float(age)
+    if not age > 0:
+        return current
+
+    return current - datetime.timedelta(seconds=age)
+
+
+@require_http_methods(['POST'])
+def sector_report_batch(request):
+    """Records a list of sector observations, each in the form accepted by
+    `sector_report` with the number of seconds since it was observed in
+    'age'. Only the latest observation of each sector is kept, and all are
+    written in one transaction. Nothing is recorded if any observation is
+    invalid.
+    """
     try:
-        data = json.loads(request.GET['data'])
+        data = json.loads(request.POST['data'])
     except:
         return HttpResponseBadRequest('Missing or invalid JSON in POST data')
 
+    if not isinstance(data, list):
+        return HttpResponseBadRequest('Expected a list of observations')
+
+    if len(data) > REPORT_BATCH_LIMIT:
+        return HttpResponseBadRequest('At most %d observations may be reported at once' % REPORT_BATCH_LIMIT)
+
+    observations = []
+    errors = dict()
+
+    for i, item in enumerate(data):
+        if not isinstance(item, dict):
+            errors[i] = {'__all__': ['Expected an observation']}
+            continue
+
+        form = IonStormForm(item)
+        if not form.is_valid():
+            errors[i] = form_errors(form)
+            continue
+
+        missing = [k for k in ('has_storm', 'has_obstacles') if k not in item]
+        if missing:
+            errors[i] = dict((k, ['This field is required.']) for k in missing)
+            continue
+
+        try:
+            observed = observed_at(item.get('age'))
+        except (OverflowError, TypeError, ValueError):
+            errors[i] = {'age': ['Expected a number of seconds']}
+            continue
+
+        sector = form.cleaned_data
+        observations.append((sector['sid'], sector['x'], sector['y'],
+                             bool(item['has_storm']), bool(item['has_obstacles']), observed))
+
+    if errors:
+        return JsonResponse({'result': 'failure', 'errors': errors})
+
+    reports.BUFFER.extend(observations)
+    reports.BUFFER.flush()
+
+    return JsonResponse({'result': 'success', 'reported': len(observations)})
+
+
+def plot_request(data):
+    """Returns the (route, strategy) requested by one plot request's data,
+    which is either a list of (sid, x, y) waypoints or a dictionary with the
+    waypoints in 'route' and an optional 'strategy'.
+    """
     strategy = 'safe'
 
     if isinstance(data, dict):
@@ -69,33 +136,77 @@ def plot(request):
     else:
         route = data
 
+    return route, strategy
+
+
+@require_http_methods(['GET'])
+def plot(request):
+    try:
+        data = json.loads(request.GET['data'])
+    except:
+        return HttpResponseBadRequest('Missing or invalid JSON in POST data')
+
+    route, strategy = plot_request(data)
+
     print 'STRATEGY:', strategy
 
-    def sector(s, x, y):
-        point = Point(x, y)
-        system = short_system_name(SYSTEM_NAMES[s])
-        return Sector(system, point)
+    try:
+        result = workers.PLANNERS.plan(route, strategy, hazards.snapshot())
+    except workers.Overloaded:
+        result = {'result': 'failure', 'error': 'Too many routes are being plotted, try again shortly'}
+    except workers.TimedOut:
+        result = {'result': 'failure', 'error': 'Route plotting timed out'}
 
-    avoid = IonStorm.objects.sectors()
-    obstacles = set()
+    return JsonResponse(result)
 
-    if strategy == 'safe':
-        obstacles = set(Obstacle.objects.sectors())
-        avoid = avoid | obstacles
 
-    waypoints = [sector(*s) for s in route]
-    steps = navigate(waypoints, avoid, obstacles)
+@require_http_methods(['GET', 'POST'])
+def plot_batch(request):
+    """Plans a list of routes, each in the form accepted by `plot`, against
+    a single hazard snapshot, in one worker (see `vo.nav.workers`) within one
+    deadline. Results are returned in the order requested.
+    """
+    try:
+        data = json.loads(request.REQUEST['data'])
+    except:
+        return HttpResponseBadRequest('Missing or invalid JSON in request data')
 
-    if steps:
-        sectors = [s.sector_id() for s in steps]
-        return JsonResponse({'result': 'success', 'route': sectors})
-    else:
-        return JsonResponse({'result': 'failure', 'error': 'No possible route found'})
+    if not isinstance(data, list):
+        return HttpResponseBadRequest('Expected a list of routes')
+
+    if len(data) > PLOT_BATCH_LIMIT:
+        return HttpResponseBadRequest('At most %d routes may be plotted at once' % PLOT_BATCH_LIMIT)
+
+    requests = []
+    for item in data:
+        try:
+            requests.append(plot_request(item))
+        except (KeyError, TypeError):
+            requests.append(None)
+
+    try:
+        results = workers.PLANNERS.plan_batch(requests, hazards.snapshot())
+    except workers.Overloaded:
+        return JsonResponse({'result': 'failure', 'error': 'Too many routes are being plotted, try again shortly'})
+    except workers.TimedOut:
+        return JsonResponse({'result': 'failure', 'error': 'Route plotting timed out'})
+
+    # A batch that fails in its worker fails as a whole.
+    if isinstance(results, dict):
+        return JsonResponse(results)
+
+    return JsonResponse({'result': 'success', 'routes': results})
 
 
 @require_http_methods(['GET'])
 def list_storms(request):
-    storms = IonStorm.objects.sectors()
-    sectors = [s.sector_id() for s in storms]
-    sectors.sort()
+    sectors = hazards.snapshot().storm_ids
     return JsonResponse({'result': 'success', 'storms': sectors})
+
+
+@require_http_methods(['GET'])
+def route_cache_stats(request):
+    """Returns the route cache's hit, miss and eviction counts and size, added
+    up over every process planning routes.
+    """
+    return JsonResponse({'result': 'success', 'stats': workers.PLANNERS.cache_stats()})
@@ -0,0 +1,219 @@
+"""
+vo.nav.workers
+
+Runs route planning for the plot views in a bounded pool of worker processes,
+so that an expensive route cannot tie up the process serving other requests.
+Each plan (or batch of plans) has an absolute deadline, enforced both by the
+caller's wait and by an alarm in the worker; a worker drops a task whose
+deadline passed while it was queued, so tasks the caller has given up on do
+not hold up those behind them. Work is refused outright once too many plans
+are pending.
+
+Nothing in this package starts the pool: the serving process must call
+`vo.nav.workers.start()` once at startup, before it starts any threads (e.g.
+from its WSGI module, just after `get_wsgi_application`), since a process
+forked while another thread holds a lock would never see it released.
+Workers are never forked while serving requests; until the pool is started,
+or if NAV_POOL_SIZE is 0, plans run in the calling process, limited by their
+Budgets (see `vo.nav.routing`) rather than a deadline, though still refused
+once too many are pending.
+
+Workers fill their segment tables before taking work. Each task carries the
+caller's HazardSnapshot as bitboards; a worker keeps the last snapshot it was
+sent, so its route cache stays valid between tasks. Each worker sends back
+its route cache's counters with every result, so that they can be added up
+by `cache_stats`.
+"""
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+from django.conf import settings
+
+from vo.nav import routing
+from vo.nav.hazards import HazardSnapshot, SystemHazards
+from vo.util.nav import segment_table
+
+
+"""
+Number of worker processes (0 plans in the calling process), the number of
+seconds a plan or batch may take, and the number of plans that may be
+pending at once before further plans are refused.
+"""
+POOL_SIZE = getattr(settings, 'NAV_POOL_SIZE', 2)
+TIMEOUT = getattr(settings, 'NAV_PLOT_TIMEOUT', 5.0)
+MAX_PENDING = getattr(settings, 'NAV_POOL_MAX_PENDING', 4 * max(POOL_SIZE, 1))
+
+
+class Overloaded(Exception):
+    """Raised when a plan is refused because too many are pending.
+    """
+
+
+class TimedOut(Exception):
+    """Raised when a plan does not finish by its deadline.
+    """
+
+
+class PlannerPool(object):
+    """A pool of `processes` worker processes planning routes, accepting at
+    most `max_pending` plans at a time.
+    """
+    def __init__(self, processes, max_pending, timeout):
+        self.processes = processes
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = 0
+        self.pool = None
+        self.worker_stats = dict()
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Starts the worker processes, if they have not been started.
+        """
+        with self.lock:
+            if self.pool is None and self.processes > 0:
+                self.pool = multiprocessing.Pool(self.processes, initializer=_initialize)
+
+    def plan(self, route, strategy, snapshot):
+        """Returns `routing.plot_result` for a route, planned in a worker.
+        Raises Overloaded if too many plans are pending, or TimedOut if the
+        plan does not finish in time.
+        """
+        return self._run(routing.plot_result, _plan, (route, strategy), snapshot)
+
+    def plan_batch(self, requests, snapshot):
+        """Returns `routing.plot_results` for a list of requests, planned in
+        one worker, as `plan` does.
+        """
+        return self._run(routing.plot_results, _plan_batch, (requests,), snapshot)
+
+    def _run(self, local, remote, args, snapshot):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise Overloaded()
+            self.pending += 1
+
+        # Released by whichever comes first: the worker returning, or the
+        # caller giving up on it (a worker that dies never returns). A task
+        # given up on is dropped by the worker once its deadline has passed.
+        released = []
+
+        def release(result=None):
+            with self.lock:
+                if not released:
+                    released.append(True)
+                    self.pending -= 1
+
+        if self.pool is None:
+            try:
+                return local(*(args + (snapshot,)))
+            finally:
+                release()
+
+        deadline = time.time() + self.timeout
+        try:
+            result = self.pool.apply_async(
+                remote, args + (_payload(snapshot), deadline), callback=release)
+        except:
+            release()
+            raise
+
+        try:
+            pid, stats, result = result.get(self.timeout)
+        except multiprocessing.TimeoutError:
+            release()
+            raise TimedOut()
+
+        with self.lock:
+            self.worker_stats[pid] = stats
+        return result
+
+    def cache_stats(self):
+        """Returns the counters and size of the route cache (see
+        `routing.RouteCache.stats`) added up over this process and the last
+        reported by each worker, along with the number of workers reporting.
+        """
+        totals = routing.ROUTE_CACHE.stats()
+        with self.lock:
+            for stats in self.worker_stats.itervalues():
+                for key, value in stats.iteritems():
+                    totals[key] += value
+            totals['workers'] = len(self.worker_stats)
+        return totals
+
+
+PLANNERS = PlannerPool(POOL_SIZE, MAX_PENDING, TIMEOUT)
+
+
+def start():
+    """Starts the PLANNERS pool. Call once at startup, before any threads are
+    started.
+    """
+    PLANNERS.start()
+
+
+def _payload(snapshot):
+    """Returns the parts of `snapshot` sent to a worker.
+    """
+    systems = [(s, h.storms, h.obstacles, h.version) for s, h in snapshot.systems.iteritems()]
+    return (snapshot.version, systems)
+
+
+class _Deadline(Exception):
+    pass
+
+
+def _expire(signum, frame):
+    raise _Deadline()
+
+
+_snapshot = None
+
+
+def _initialize():
+    signal.signal(signal.SIGALRM, _expire)
+    segment_table(16).fill()
+
+
+def _plan(route, strategy, payload, deadline):
+    return _run(routing.plot_result, (route, strategy), payload, deadline)
+
+
+def _plan_batch(requests, payload, deadline):
+    return _run(routing.plot_results, (requests,), payload, deadline)
+
+
+def _run(function, args, payload, deadline):
+    # Never raises, so that the pool always calls back.
+    try:
+        result = _run_by_deadline(function, args, payload, deadline)
+    except _Deadline:
+        result = {'result': 'failure', 'error': 'Route plotting timed out'}
+    except Exception:
+        result = {'result': 'failure', 'error': 'Route plotting failed'}
+    return os.getpid(), routing.ROUTE_CACHE.stats(), result
+
+
+def _run_by_deadline(function, args, payload, deadline):
+    global _snapshot
+
+    # The caller has already given up on a task that waited out its
+    # deadline in the queue.
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise _Deadline()
+
+    version, systems = payload
+    if _snapshot is None or _snapshot.version != version:
+        systems = dict((s, SystemHazards(s, storms, obstacles, v))
+                       for s, storms, obstacles, v in systems)
+        _snapshot = HazardSnapshot(version, systems, None)
+
+    signal.setitimer(signal.ITIMER_REAL, max(deadline - time.time(), 0.001))
+    try:
+        return function(*(args + (_snapshot,)))
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
@@ -38,6 +38,13 @@ def sector_vochar2py(x, y):
     return sector_vo2py(ord(x.upper()) - ord('A') + 1, y)
 
 
+def sector_id(sid, x, y):
+    """Returns the Vendetta sector id of integral point sector (x, y) in the
+    system with id `sid`.
+    """
+    return (sid - 1) * 256 + (15 - y) * 16 + x + 1
+
+
 """
 System names, in order by the system id. System ids are zero-based, so the
 index in this list maps to the system id.
@@ -1,6 +1,9 @@
-from django.db import models
+import sqlite3
+
+from django.db import IntegrityError, connections, models, router, transaction
 
 from vo.util.info import SYSTEM_NAMES, short_system_name, sector_py2vochar
+from vo.util.nav import Point, Sector
 
 
 SID_CHOICES = [(i, SYSTEM_NAMES[i]) for i in xrange(1, len(SYSTEM_NAMES))]
@@ -9,6 +12,228 @@ Y_CHOICES = [(i, 16 - i) for i in xrange(0, 16)]
 Y_CHOICES.reverse()
 
 
+"""
+Number of rows written by a single upsert or bulk update statement, keeping
+within the limit on query parameters of SQLite.
+"""
+BULK_CHUNK = 100
+
+
+class SectorManager(models.Manager):
+    """Manager for models derived from AbstractSector, which are unique by
+    sector.
+    """
+    def upsert(self, rows, latest=None):
+        """Ensures there is a row for each sector in `rows`, a dictionary of
+        (sid, x, y) => {field name => value}, setting the given fields both
+        on new rows and on existing ones. Every sector must be given the same
+        fields. Fields not given take their defaults on new rows and are left
+        alone on existing ones. If `latest` names one of the fields, existing
+        rows are only updated where the new value of that field is later.
+
+        On databases that support it, each chunk of rows is written in a
+        single INSERT that resolves conflicts on the sector itself, so
+        concurrent writers cannot race each other into an IntegrityError.
+        Elsewhere, or where the table has no unique index on the sector (as
+        in tables created before it was added), each row is updated, or
+        created if there is none.
+        """
+        if not rows:
+            return
+
+        # Writing rows in one order keeps concurrent writers from
+        # deadlocking.
+        sectors = sorted(rows)
+        names = sorted(rows[sectors[0]])
+        if latest is not None:
+            # MySQL assigns in order, so the field compared is set last.
+            names.remove(latest)
+            names.append(latest)
+
+        connection = connections[self.db]
+        syntax = _upsert_syntax(connection, self.model._meta)
+        if syntax is None:
+            self._upsert_rows(sectors, rows, latest)
+            return
+
+        opts = self.model._meta
+        qn = connection.ops.quote_name
+        table = qn(opts.db_table)
+        fields = [opts.get_field(name) for name in ['sid', 'x', 'y'] + names]
+        columns = [qn(f.column) for f in fields]
+        updates = columns[3:]
+
+        # Other fields, such as timestamps, are filled in for new rows as the
+        # ORM would fill them in.
+        defaults = []
+        for field in opts.local_fields:
+            if field not in fields and not isinstance(field, models.AutoField):
+                defaults.append(field)
+                columns.append(qn(field.column))
+
+        if syntax == 'mysql':
+            assignments = []
+            for column in updates:
+                value = 'VALUES(%s)' % column
+                if latest is not None:
+                    newest = qn(opts.get_field(latest).column)
+                    value = 'IF(VALUES(%s) > %s, %s, %s)' % (newest, newest, value, column)
+                assignments.append('%s = %s' % (column, value))
+            if not assignments:
+                assignments = ['%s = %s' % (columns[0], columns[0])]
+            clause = 'ON DUPLICATE KEY UPDATE %s' % ', '.join(assignments)
+        elif updates:
+            clause = 'ON CONFLICT (%s) DO UPDATE SET %s' % (
+                ', '.join(columns[:3]), ', '.join('%s = excluded.%s' % (c, c) for c in updates))
+            if latest is not None:
+                newest = qn(opts.get_field(latest).column)
+                clause += ' WHERE %s.%s < excluded.%s' % (table, newest, newest)
+        else:
+            clause = 'ON CONFLICT (%s) DO NOTHING' % ', '.join(columns[:3])
+
+        row = '(%s)' % ', '.join(['%s'] * len(columns))
+        cursor = connection.cursor()
+
+        for i in xrange(0, len(sectors), BULK_CHUNK):
+            chunk = sectors[i:i + BULK_CHUNK]
+            params = []
+            for sid, x, y in chunk:
+                instance = self.model(sid=sid, x=x, y=y, **rows[(sid, x, y)])
+                for field in fields:
+                    params.append(field.get_db_prep_save(getattr(instance, field.attname), connection=connection))
+                for field in defaults:
+                    params.append(field.get_db_prep_save(field.pre_save(instance, True), connection=connection))
+
+            sql = 'INSERT INTO %s (%s) VALUES %s %s' % (
+                table, ', '.join(columns), ', '.join([row] * len(chunk)), clause)
+            cursor.execute(sql, params)
+
+        transaction.commit_unless_managed(using=self.db)
+
+    def _upsert_rows(self, sectors, rows, latest):
+        for sid, x, y in sectors:
+            values = rows[(sid, x, y)]
+            existing = self.filter(sid=sid, x=x, y=y)
+
+            if values:
+                newer = existing
+                if latest is not None:
+                    newer = existing.filter(**{latest + '__lt': values[latest]})
+                if newer.update(**values):
+                    continue
+            if existing.exists():
+                continue
+
+            savepoint = transaction.savepoint(using=self.db)
+            try:
+                self.model(sid=sid, x=x, y=y).save(force_insert=True, using=self.db)
+            except IntegrityError:
+                # Created by another writer since the update above.
+                transaction.savepoint_rollback(savepoint, using=self.db)
+                self._upsert_rows([(sid, x, y)], rows, latest)
+                continue
+            transaction.savepoint_commit(savepoint, using=self.db)
+
+            # Set by an update, since saving would apply any auto_now.
+            if values:
+                existing.update(**values)
+
+
+def bulk_update(model, rows):
+    """Updates rows of `model` in a single statement per chunk of rows.
+    `rows` is a dictionary of primary key => {field name => value}, naming
+    the same fields for every row. Django has no bulk update of differing
+    values, so each field is set with a CASE on the primary key.
+    """
+    if not rows:
+        return
+
+    using = router.db_for_write(model)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    opts = model._meta
+
+    pks = sorted(rows)
+    fields = [opts.get_field(name) for name in sorted(rows[pks[0]])]
+    pk_column = qn(opts.pk.column)
+    cursor = connection.cursor()
+
+    for i in xrange(0, len(pks), BULK_CHUNK):
+        chunk = pks[i:i + BULK_CHUNK]
+        assignments = []
+        params = []
+
+        for field in fields:
+            assignments.append('%s = CASE %s %s END' % (
+                qn(field.column), pk_column, ' '.join(['WHEN %s THEN %s'] * len(chunk))))
+            for pk in chunk:
+                params.append(pk)
+                params.append(field.get_db_prep_save(rows[pk][field.name], connection=connection))
+
+        params.extend(chunk)
+        sql = 'UPDATE %s SET %s WHERE %s IN (%s)' % (
+            qn(opts.db_table), ', '.join(assignments), pk_column, ', '.join(['%s'] * len(chunk)))
+        cursor.execute(sql, params)
+
+    transaction.commit_unless_managed(using=using)
+
+
+def _upsert_syntax(connection, opts):
+    """Returns the flavour of single statement upsert supported by
+    `connection` for the sector model with Options `opts`, or None if it has
+    none or the model's table has no unique index on the sector.
+    """
+    if connection.vendor == 'sqlite' and sqlite3.sqlite_version_info >= (3, 24, 0):
+        syntax = 'sqlite'
+    elif connection.vendor == 'postgresql' and connection.pg_version >= 90500:
+        syntax = 'postgresql'
+    elif connection.vendor == 'mysql':
+        syntax = 'mysql'
+    else:
+        return None
+
+    key = (connection.alias, opts.db_table)
+    if key not in _sector_keys:
+        sector = frozenset(opts.get_field(name).column for name in ('sid', 'x', 'y'))
+        _sector_keys[key] = sector in unique_indexes(connection, opts.db_table)
+    if _sector_keys[key]:
+        return syntax
+
+
+# Whether each (database alias, table) has a unique index on the sector.
+_sector_keys = dict()
+
+
+def unique_indexes(connection, table):
+    """Returns the set of columns in each unique index of `table`, as a list
+    of frozensets, on SQLite, PostgreSQL or MySQL.
+    """
+    cursor = connection.cursor()
+    indexes = dict()
+
+    if connection.vendor == 'sqlite':
+        qn = connection.ops.quote_name
+        cursor.execute('PRAGMA index_list(%s)' % qn(table))
+        for row in cursor.fetchall():
+            if row[2]:
+                cursor.execute('PRAGMA index_info(%s)' % qn(row[1]))
+                indexes[row[1]] = set(info[2] for info in cursor.fetchall())
+    elif connection.vendor == 'postgresql':
+        cursor.execute(
+            'SELECT i.indexrelid, a.attname FROM pg_index i '
+            'JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) '
+            'WHERE i.indrelid = %s::regclass AND i.indisunique', [table])
+        for index, column in cursor.fetchall():
+            indexes.setdefault(index, set()).add(column)
+    elif connection.vendor == 'mysql':
+        cursor.execute('SHOW INDEX FROM %s' % connection.ops.quote_name(table))
+        for row in cursor.fetchall():
+            if not row[1]:
+                indexes.setdefault(row[2], set()).add(row[4])
+
+    return [frozenset(columns) for columns in indexes.itervalues()]
+
+
 class AbstractSector(models.Model):
     x = models.PositiveSmallIntegerField(choices=X_CHOICES)
     y = models.PositiveSmallIntegerField(choices=Y_CHOICES)
@@ -38,3 +263,8 @@ class AbstractSector(models.Model):
         """Returns the short string name of the system.
         """
         return short_system_name(self.system())
+
+    def sector(self):
+        """Returns the location as a `vo.util.nav.Sector`.
+        """
+        return Sector(self.short_system(), Point(self.x, self.y))
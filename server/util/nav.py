@@ -1,13 +1,45 @@
-from copy import copy
-from info import JUMPS, SYSTEM_ID, WORMHOLE, sector_py2vo, sector_py2vochar
+import heapq
+import math
+import threading
+import time
+from binascii import unhexlify
+from collections import OrderedDict, deque
+from info import JUMPS, SYSTEM_ID, WORMHOLE, sector_id, sector_py2vochar
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class Point(object):
-    """Represents a single point on a sector map.
+    """Represents a single point on a sector map. Points are immutable; each
+    point on a 16x16 sector map is a single shared instance, so creating one
+    allocates nothing.
     """
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
+    __slots__ = ('x', 'y', '_hash')
+
+    def __new__(cls, x, y):
+        if 0 <= x < 16 and 0 <= y < 16:
+            return _POINTS[y * 16 + x]
+        return cls._create(x, y)
+
+    @classmethod
+    def _create(cls, x, y):
+        point = object.__new__(cls)
+        point.x = x
+        point.y = y
+
+        # Algorithm from http://stackoverflow.com/a/13871379/89182
+        if x >= y:
+            point._hash = x * x + x + y
+        else:
+            point._hash = x + y * y
+
+        return point
+
+    def __reduce__(self):
+        return (Point, (self.x, self.y))
 
     def __repr__(self):
         return self.__unicode__()
@@ -16,15 +48,13 @@ class Point(object):
         return '%s-%d' % sector_py2vochar(self.x, self.y)
 
     def __hash__(self):
-        """Algorithm from http://stackoverflow.com/a/13871379/89182
-        """
-        if self.x >= self.y:
-            return self.x * self.x + self.x + self.y
-        else:
-            return self.x + self.y * self.y
+        return self._hash
 
     def __eq__(self, other):
-        return self.x == other.x and self.y == other.y
+        return self is other or (self.x == other.x and self.y == other.y)
+
+    def __ne__(self, other):
+        return not self == other
 
     def is_valid(self, grid_size):
         """Returns True if this Point is in the positive plane (x and y > 0)
@@ -69,6 +99,43 @@ class Point(object):
             yield Point(i, j)
 
 
+def walk(x, y, end_x, end_y):
+    """Generates (x, y) coordinates along the line between (x, y) and
+    (end_x, end_y). If the slope is 45 degrees, no coordinates are generated
+    where the line passes directly between two sectors.
+    """
+    dx = abs(end_x - x)
+    dy = abs(end_y - y)
+    n = 1 + dx + dy
+    x_inc = 1 if end_x > x else -1
+    y_inc = 1 if end_y > y else -1
+    error = dx - dy
+
+    dx *= 2
+    dy *= 2
+
+    const_slope = dy == dx
+
+    while n > 0:
+        yield (x, y)
+
+        if const_slope:
+            x += x_inc
+            y += y_inc
+            n -= 1
+        elif error > 0:
+            x += x_inc
+            error -= dy
+        else:
+            y += y_inc
+            error += dx
+
+        n -= 1
+
+
+_POINTS = [Point._create(i % 16, i // 16) for i in xrange(0, 256)]
+
+
 class Segment(object):
     """Represents a line segment between two Points.
     """
@@ -83,36 +150,9 @@ class Segment(object):
         point. If the slope is 45 degrees, no Points are generated where
         the line segment passes directly between two sectors.
         """
-        x = self.start.x
-        y = self.start.y
-        dx = abs(self.end.x - x)
-        dy = abs(self.end.y - y)
-        n = 1 + dx + dy
-        x_inc = 1 if self.end.x > x else -1
-        y_inc = 1 if self.end.y > y else -1
-        error = dx - dy
-
-        dx *= 2
-        dy *= 2
-
-        const_slope = dy == dx
-
-        while n > 0:
+        for (x, y) in walk(self.start.x, self.start.y, self.end.x, self.end.y):
             yield Point(x, y)
 
-            if const_slope:
-                x += x_inc
-                y += y_inc
-                n -= 1
-            elif error > 0:
-                x += x_inc
-                error -= dy
-            else:
-                y += y_inc
-                error += dx
-
-            n -= 1
-
     def sectors(self, avoid):
         """Generates Points along the path, up until it would collide with a
         point in set `avoid`.
@@ -139,46 +179,587 @@ class Segment(object):
         return waypoints
 
 
+class SegmentTable(object):
+    """Bitboards of the sectors crossed by the line segment between every pair
+    of sectors on a grid of a given size. Sector (x, y) is bit `y * size + x`.
+    Each mask holds exactly the sectors generated by `Segment.walk`. Rows
+    (every segment leaving one sector) are computed the first time they are
+    used.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.rows = [None] * (size * size)
+
+    def row(self, start):
+        """Returns the list of segment masks from sector index `start` to
+        every sector index on the grid.
+        """
+        row = self.rows[start]
+        if row is None:
+            size = self.size
+            start_x, start_y = start % size, start // size
+            row = []
+
+            for end in xrange(0, size * size):
+                mask = 0
+                for (x, y) in walk(start_x, start_y, end % size, end // size):
+                    mask |= 1 << (y * size + x)
+                row.append(mask)
+
+            self.rows[start] = row
+
+        return row
+
+    def mask(self, start, end):
+        """Returns the bitboard of sectors crossed between sector indexes
+        `start` and `end`.
+        """
+        return self.row(start)[end]
+
+    def fill(self):
+        """Computes every row of the table up front.
+        """
+        for start in xrange(0, self.size * self.size):
+            self.row(start)
+
+
+_SEGMENT_TABLES = dict()
+
+
+def segment_table(size):
+    """Returns the shared SegmentTable for a grid of `size` square sectors.
+    """
+    if size not in _SEGMENT_TABLES:
+        _SEGMENT_TABLES[size] = SegmentTable(size)
+    return _SEGMENT_TABLES[size]
+
+
+class Grid(object):
+    """A square grid of sectors whose avoidance points and obstacles are each
+    stored as a bitboard, so that a segment can be tested for clearance with a
+    single AND against its mask from the SegmentTable.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.segments = segment_table(size)
+        self.avoid = 0
+        self.obstacles = 0
+
+    def index(self, point):
+        """Returns the bit index of `point`, or None if it is off the grid.
+        """
+        if 0 <= point.x < self.size and 0 <= point.y < self.size:
+            return point.y * self.size + point.x
+
+    def point(self, index):
+        """Returns the Point at bit index `index`.
+        """
+        return Point(index % self.size, index // self.size)
+
+    def points(self, mask):
+        """Generates the Points whose bits are set in `mask`.
+        """
+        index = 0
+        while mask:
+            if mask & 1:
+                yield self.point(index)
+            mask >>= 1
+            index += 1
+
+    def add_avoidance(self, index):
+        self.avoid |= 1 << index
+
+    def add_obstacle(self, index):
+        self.obstacles |= 1 << index
+
+    def is_clear(self, start, end):
+        """Returns True if no avoidance point lies on the segment between bit
+        indexes `start` and `end`.
+        """
+        return not self.segments.mask(start, end) & self.avoid
+
+    def is_blocked(self, index):
+        """Returns True if bit index `index` is an obstacle or avoidance point.
+        """
+        return bool((self.avoid | self.obstacles) >> index & 1)
+
+
+class Budget(object):
+    """A limit on the work a search may do, as a number of node expansions,
+    a number of seconds, or both (None meaning no limit). A search that runs
+    out of budget returns the best route it has found so far, if any, and
+    clears `optimal`.
+    """
+    def __init__(self, expansions=None, seconds=None, parent=None):
+        self.expansions = expansions
+        self.deadline = None
+        if seconds is not None:
+            self.deadline = time.time() + seconds
+        self.parent = parent
+        self.optimal = True
+
+    def spend(self, expansions=1):
+        """Records `expansions` node expansions against this budget and the
+        budget it was split from.
+        """
+        if self.expansions is not None:
+            self.expansions -= expansions
+        if self.parent is not None:
+            self.parent.spend(expansions)
+
+    def exhausted(self):
+        """Returns True if no more work may be done.
+        """
+        if self.expansions is not None and self.expansions <= 0:
+            return True
+        if self.deadline is not None and time.time() >= self.deadline:
+            return True
+        return self.parent is not None and self.parent.exhausted()
+
+    def give_up(self):
+        """Records that a result was cut short by the budget.
+        """
+        self.optimal = False
+        if self.parent is not None:
+            self.parent.give_up()
+
+    def split(self, parts):
+        """Returns a Budget holding an equal share of what remains when it is
+        divided into `parts`, and at least one expansion. Work done against
+        the share is also spent from this budget, so a share left unused is
+        available to later shares.
+        """
+        expansions = None
+        if self.expansions is not None:
+            expansions = max(max(self.expansions, 0) // parts, 1)
+
+        seconds = None
+        if self.deadline is not None:
+            seconds = max(self.deadline - time.time(), 0) / float(parts)
+
+        return Budget(expansions, seconds, self)
+
+
+class VisibilityGraph(object):
+    """The graph of sectors on a grid that can be reached from one another in
+    a straight line without crossing an avoidance point. Sectors that are
+    neither obstacles nor avoidance points may be used as waypoints. The
+    sectors visible from each sector are computed the first time they are
+    needed and kept for the life of the graph.
+    """
+    def __init__(self, size, avoid, obstacles):
+        self.size = size
+        self.avoid = avoid
+        self.obstacles = obstacles
+        self.segments = segment_table(size)
+        self.free = ((1 << (size * size)) - 1) & ~(avoid | obstacles)
+        self.visible = [None] * (size * size)
+
+    def neighbours(self, index):
+        """Returns a bitboard of the sectors visible from bit index `index`.
+        """
+        mask = self.visible[index]
+        if mask is None:
+            avoid = self.avoid
+            mask = 0
+            for end, segment in enumerate(self.segments.row(index)):
+                if not segment & avoid:
+                    mask |= 1 << end
+            self.visible[index] = mask
+        return mask
+
+    def distance(self, start, end):
+        """Returns the straight line distance between bit indexes `start` and
+        `end`.
+        """
+        size = self.size
+        return math.hypot(start % size - end % size, start // size - end // size)
+
+    def greedy_search(self, start, end, budget=None):
+        """Returns a list of bit indexes from `start` to `end`, or None if
+        `end` cannot be reached (or `budget` runs out first). Sectors are
+        expanded nearest `end` first, so a route is usually found after a few
+        expansions, and waypoints that can be skipped in a straight line are
+        then dropped; the route may still use more waypoints than needed.
+        """
+        end_bit = 1 << end
+        parents = {start: None}
+        reached = 1 << start
+        queue = [(self.distance(start, end), start)]
+
+        while queue:
+            if budget is not None:
+                if budget.exhausted():
+                    budget.give_up()
+                    return None
+                budget.spend()
+
+            _, index = heapq.heappop(queue)
+            mask = self.neighbours(index)
+            if mask & end_bit:
+                parents[end] = index
+                break
+
+            mask &= self.free & ~reached
+            reached |= mask
+            while mask:
+                bit = mask & -mask
+                mask ^= bit
+                neighbour = bit.bit_length() - 1
+                parents[neighbour] = index
+                heapq.heappush(queue, (self.distance(neighbour, end), neighbour))
+        else:
+            return None
+
+        route = [end]
+        while parents[route[-1]] is not None:
+            route.append(parents[route[-1]])
+        route.reverse()
+
+        shortcut = [start]
+        i = 0
+        while i < len(route) - 1:
+            visible = self.neighbours(route[i])
+            j = len(route) - 1
+            while not visible >> route[j] & 1:
+                j -= 1
+            shortcut.append(route[j])
+            i = j
+
+        return shortcut
+
+    def search(self, start, end, budget=None):
+        """Returns the list of bit indexes from `start` to `end` that uses the
+        fewest waypoints, breaking ties by total distance, or None if `end`
+        cannot be reached.
+
+        Sectors are explored in layers by the number of waypoints needed to
+        reach them. Every sector on a route with the fewest waypoints lies in
+        the layer matching its position on the route, so the shortest such
+        route is found by relaxing distances from one layer to the next.
+
+        With a `budget`, a route is first found by `greedy_search` and the
+        layered search then runs until it finishes or the budget runs out, in
+        which case the greedy route is returned instead.
+        """
+        end_bit = 1 << end
+        if self.neighbours(start) & end_bit:
+            return [start, end]
+        if start == end:
+            return None
+
+        fallback = None
+        if budget is not None:
+            # The greedy search visits every reachable sector before giving
+            # up, so unless it ran out of budget there is no route at all.
+            fallback = self.greedy_search(start, end, budget)
+            if fallback is None:
+                return None
+
+        best = {start: (0.0, None)}
+        reached = 1 << start
+        frontier = [start]
+
+        while frontier:
+            layer = 0
+            for index in frontier:
+                if budget is not None:
+                    if budget.exhausted():
+                        budget.give_up()
+                        return fallback
+                    budget.spend()
+                layer |= self.neighbours(index)
+
+            if layer & end_bit:
+                frontier = [i for i in frontier if self.neighbours(i) & end_bit]
+                layer = end_bit
+            else:
+                layer &= self.free & ~reached
+                if not layer:
+                    return None
+                reached |= layer
+
+            for index in frontier:
+                distance = best[index][0]
+                mask = self.neighbours(index) & layer
+                while mask:
+                    bit = mask & -mask
+                    mask ^= bit
+                    neighbour = bit.bit_length() - 1
+
+                    cost = distance + self.distance(index, neighbour)
+                    if neighbour not in best or cost < best[neighbour][0]:
+                        best[neighbour] = (cost, index)
+
+            if layer == end_bit:
+                route = [end]
+                current = best[end][1]
+                while current is not None:
+                    route.append(current)
+                    current = best[current][1]
+                route.reverse()
+                return route
+
+            frontier = []
+            while layer:
+                bit = layer & -layer
+                layer ^= bit
+                frontier.append(bit.bit_length() - 1)
+
+
+"""
+Maximum number of VisibilityGraphs kept by `visibility_graph`.
+"""
+VISIBILITY_GRAPH_CACHE_SIZE = 128
+
+_VISIBILITY_GRAPHS = OrderedDict()
+_VISIBILITY_GRAPHS_LOCK = threading.Lock()
+
+
+def visibility_graph(size, avoid, obstacles):
+    """Returns a VisibilityGraph for a grid of `size` square sectors with the
+    `avoid` and `obstacles` bitboards, reusing the graph built by an earlier
+    call with the same hazards where possible.
+    """
+    key = (size, avoid, obstacles)
+    with _VISIBILITY_GRAPHS_LOCK:
+        graph = _VISIBILITY_GRAPHS.pop(key, None)
+        if graph is None:
+            graph = VisibilityGraph(size, avoid, obstacles)
+        _VISIBILITY_GRAPHS[key] = graph
+
+        while len(_VISIBILITY_GRAPHS) > VISIBILITY_GRAPH_CACHE_SIZE:
+            _VISIBILITY_GRAPHS.popitem(last=False)
+
+    return graph
+
+
+class ArrayTables(object):
+    """NumPy arrays shared by every ArrayVisibilityGraph on a grid of a given
+    size: the SegmentTable's masks packed into bytes, with shape (cells,
+    cells, bytes), and the distance between every pair of sectors.
+    """
+    def __init__(self, size):
+        table = segment_table(size)
+        cells = size * size
+        self.size = size
+        self.width = (cells + 7) // 8
+
+        packed = []
+        for start in xrange(0, cells):
+            packed.extend(self.pack(mask) for mask in table.row(start))
+        self.segments = numpy.frombuffer(''.join(packed), dtype=numpy.uint8)
+        self.segments = self.segments.reshape((cells, cells, self.width))
+
+        indexes = numpy.arange(cells)
+        xs, ys = indexes % size, indexes // size
+        self.distances = numpy.hypot(xs[:, None] - xs[None, :], ys[:, None] - ys[None, :])
+
+    def pack(self, mask):
+        """Packs bitboard `mask` into a string of bytes, most significant
+        first.
+        """
+        return unhexlify('%0*x' % (self.width * 2, mask))
+
+    def flags(self, mask):
+        """Returns bitboard `mask` as a size x size array of flags.
+        """
+        flags = [bool(mask >> i & 1) for i in xrange(0, self.size * self.size)]
+        return numpy.array(flags).reshape((self.size, self.size))
+
+
+_ARRAY_TABLES = dict()
+
+
+def array_tables(size):
+    """Returns the shared ArrayTables for a grid of `size` square sectors.
+    """
+    if numpy is None:
+        raise ImportError('the numpy engine requires numpy')
+
+    if size not in _ARRAY_TABLES:
+        _ARRAY_TABLES[size] = ArrayTables(size)
+    return _ARRAY_TABLES[size]
+
+
+class ArrayVisibilityGraph(object):
+    """A vectorized counterpart to VisibilityGraph. Hazards are kept as size x
+    size arrays of flags, and visibility between every pair of sectors is
+    found with one array operation over the packed segment masks, so the
+    sectors visible from a waypoint are a row of an array rather than a
+    series of walks.
+    """
+    def __init__(self, size, avoid, obstacles):
+        tables = array_tables(size)
+        self.size = size
+        self.tables = tables
+        self.hazards = (avoid, obstacles)
+        self.avoid = tables.flags(avoid)
+        self.obstacles = tables.flags(obstacles)
+        self.free = ~(self.avoid | self.obstacles).ravel()
+
+        packed = numpy.frombuffer(tables.pack(avoid), dtype=numpy.uint8)
+        self.visible = ~(tables.segments & packed).any(axis=2)
+
+    def search(self, start, end, budget=None):
+        """Returns the list of bit indexes from `start` to `end` that uses the
+        fewest waypoints, breaking ties by total distance, or None if `end`
+        cannot be reached. Works layer by layer like VisibilityGraph.search;
+        with one waypoint, this is the intersection of the sectors visible
+        from `start` with those that can see `end`. Each layer spends the
+        size of its frontier from `budget`; as with VisibilityGraph.search, a
+        route is first found by `VisibilityGraph.greedy_search` and returned
+        if the budget runs out.
+        """
+        visible = self.visible
+        if visible[start, end]:
+            return [start, end]
+        if start == end:
+            return None
+
+        fallback = None
+        if budget is not None:
+            graph = visibility_graph(self.size, *self.hazards)
+            fallback = graph.greedy_search(start, end, budget)
+            if fallback is None:
+                return None
+
+        cells = self.size * self.size
+        best = numpy.zeros(cells)
+        parents = numpy.zeros(cells, dtype=int)
+        parents[start] = -1
+        reached = numpy.zeros(cells, dtype=bool)
+        reached[start] = True
+        frontier = numpy.array([start])
+
+        while True:
+            if budget is not None:
+                if budget.exhausted():
+                    budget.give_up()
+                    return fallback
+                budget.spend(len(frontier))
+
+            sees_end = visible[frontier, end]
+            if sees_end.any():
+                frontier = frontier[sees_end]
+                layer = numpy.array([end])
+            else:
+                mask = visible[frontier].any(axis=0) & self.free & ~reached
+                if not mask.any():
+                    return None
+                reached |= mask
+                layer = numpy.flatnonzero(mask)
+
+            pairs = numpy.ix_(frontier, layer)
+            costs = best[frontier][:, None] + self.tables.distances[pairs]
+            costs[~visible[pairs]] = numpy.inf
+            choice = costs.argmin(axis=0)
+
+            best[layer] = costs[choice, numpy.arange(len(layer))]
+            parents[layer] = frontier[choice]
+
+            if layer[0] == end:
+                route = [end]
+                while parents[route[-1]] >= 0:
+                    route.append(int(parents[route[-1]]))
+                route.reverse()
+                return route
+
+            frontier = layer
+
+
+_ARRAY_VISIBILITY_GRAPHS = OrderedDict()
+
+
+def array_visibility_graph(size, avoid, obstacles):
+    """Returns an ArrayVisibilityGraph for a grid of `size` square sectors with
+    the `avoid` and `obstacles` bitboards, reusing the graph built by an
+    earlier call with the same hazards where possible.
+    """
+    key = (size, avoid, obstacles)
+    with _VISIBILITY_GRAPHS_LOCK:
+        graph = _ARRAY_VISIBILITY_GRAPHS.pop(key, None)
+
+    if graph is None:
+        graph = ArrayVisibilityGraph(size, avoid, obstacles)
+
+    with _VISIBILITY_GRAPHS_LOCK:
+        _ARRAY_VISIBILITY_GRAPHS[key] = graph
+        while len(_ARRAY_VISIBILITY_GRAPHS) > VISIBILITY_GRAPH_CACHE_SIZE:
+            _ARRAY_VISIBILITY_GRAPHS.popitem(last=False)
+
+    return graph
+
+
+"""
+Engines that Path.calculate_path can search with: 'bitboard' walks the
+VisibilityGraph a sector at a time, and 'numpy' (only if NumPy is installed)
+uses the ArrayVisibilityGraph.
+"""
+ENGINES = {
+    'bitboard': visibility_graph,
+    'numpy': array_visibility_graph,
+}
+
+DEFAULT_ENGINE = 'bitboard'
+
+
 class Path(object):
     """A path between two points on a grid of a given size.
     """
-    def __init__(self, size, start, end):
+    def __init__(self, size, start, end, engine=DEFAULT_ENGINE):
         """Creates a new Path on a grid of `size` square sectors, running from
-        `start` to `end`.
+        `start` to `end`, whose routes are calculated with `engine` (one of
+        ENGINES).
         """
+        if engine not in ENGINES:
+            raise ValueError('unknown engine: %s' % engine)
+
         self.size = size
         self.start = start
         self.end = end
-        self.obstacles = set([])
-        self.avoid = set([])
+        self.engine = engine
+        self.grid = Grid(size)
+
+    @property
+    def obstacles(self):
+        """The frozenset of Points marked as obstacles (see `add_obstacle`).
+        """
+        return frozenset(self.grid.points(self.grid.obstacles))
+
+    @property
+    def avoid(self):
+        """The frozenset of Points marked as sectors to avoid (see
+        `add_avoidance`).
+        """
+        return frozenset(self.grid.points(self.grid.avoid))
 
     def add_obstacle(self, point):
         """Marks a Point as an obstacle to the path generator.
         """
-        self.obstacles.add(point)
+        index = self.grid.index(point)
+        if index is not None:
+            self.grid.add_obstacle(index)
 
     def add_avoidance(self, point):
         """Marks a Point as a sector to avoid in path generation.
         """
-        self.avoid.add(point)
+        index = self.grid.index(point)
+        if index is not None:
+            self.grid.add_avoidance(index)
 
     def is_valid_point(self, point):
         """Returns True if `point` exists on a grid of self.size.
         """
-        return point.is_valid(self.size)
+        return point.is_valid(self.size - 1)
 
     def has_clear_path(self, start, end):
         """Returns True if there are no avoidance points between Points start
-        and end.
+        and end, and False if either is off the grid.
         """
-        segment = Segment(start, end)
-        points = segment.waypoints(self.avoid)
-
-        if len(points) != 2:
+        if not (self.is_valid_point(start) and self.is_valid_point(end)):
             return False
-
-        (p1, p2) = points
-        return p1 == start and p2 == end
+        return self.grid.is_clear(self.grid.index(start), self.grid.index(end))
 
     def spiral(self, point):
         """Generates Points spiraling out from `point` that are valid for the
@@ -205,10 +786,7 @@ class Path(object):
             if not self.is_valid_point(p):
                 continue
 
-            if p in self.obstacles:
-                continue
-
-            if p in self.avoid:
+            if self.grid.is_blocked(self.grid.index(p)):
                 continue
 
             yield p
@@ -250,9 +828,24 @@ class Path(object):
             if waypoint is not None:
                 return [waypoint, point]
 
-    def calculate_path(self, start=None, end=None):
+    def visibility_graph(self, engine=None):
+        """Returns the visibility graph for this Path's current hazards, built
+        by `engine` (by default, the Path's engine).
+        """
+        if engine is None:
+            engine = self.engine
+
+        if engine not in ENGINES:
+            raise ValueError('unknown engine: %s' % engine)
+
+        return ENGINES[engine](self.size, self.grid.avoid, self.grid.obstacles)
+
+    def calculate_path(self, start=None, end=None, engine=None, budget=None):
         """Attempts to find a path between `start` and `end` that is clear
-        of obstacles using the fewest waypoints possible.
+        of obstacles using the fewest waypoints possible, preferring the
+        shortest total distance between paths with as many waypoints. If a
+        Budget is given and runs out, the best path found so far is returned
+        (if any) and the budget's `optimal` flag is cleared.
         """
         if start is None:
             start = self.start
@@ -260,16 +853,11 @@ class Path(object):
         if end is None:
             end = self.end
 
-        if self.has_clear_path(start, end):
-            return [start, end]
-
-        waypoint = self.find_waypoint(start, end)
-        if waypoint is not None:
-            return [start, waypoint, end]
-
-        waypoints = self.find_waypoint_2(start, end)
-        if waypoints is not None:
-            return [start, waypoints[0], waypoints[1], end]
+        route = self.visibility_graph(engine).search(self.grid.index(start),
+                                                     self.grid.index(end),
+                                                     budget)
+        if route is not None:
+            return [self.grid.point(i) for i in route]
 
     def draw(self):
         """For debugging, draws an ASCII representation of the Path.
@@ -289,17 +877,49 @@ class Path(object):
 
 
 class Sector(object):
-    """Represents an individual Sector within a system.
+    """Represents an individual Sector within a system. Sectors are immutable;
+    each sector in the universe is a single shared instance, which may also
+    be looked up by its Vendetta sector id with `Sector.from_id`.
     """
-    def __init__(self, system, point):
+    __slots__ = ('system', 'point', '_id')
+
+    def __new__(cls, system, point):
+        sectors = _SECTORS.get(system)
+        if sectors is not None and 0 <= point.x < 16 and 0 <= point.y < 16:
+            return sectors[point.y * 16 + point.x]
+
         if system not in SYSTEM_ID or system is None:
             raise ValueError('unknown system; short system name expected')
 
-        self.system = system
-        self.point = point
+        return cls._create(system, point)
+
+    @classmethod
+    def _create(cls, system, point):
+        sector = object.__new__(cls)
+        sector.system = system
+        sector.point = point
+
+        # SYSTEM_ID counts the placeholder at the start of SYSTEM_NAMES.
+        sector._id = sector_id(SYSTEM_ID[system] - 1, point.x, point.y)
+
+        return sector
+
+    @classmethod
+    def from_id(cls, sector_id):
+        """Returns the Sector with Vendetta sector id `sector_id`.
+        """
+        if not 0 < sector_id < len(_SECTOR_IDS):
+            raise ValueError('unknown sector id')
+        return _SECTOR_IDS[sector_id]
+
+    def __reduce__(self):
+        return (Sector, (self.system, self.point))
 
     def __eq__(self, other):
-        return self.system == other.system and self.point == other.point
+        return self is other or (self.system == other.system and self.point == other.point)
+
+    def __ne__(self, other):
+        return not self == other
 
     def __unicode__(self):
         return '%s %s' % (self.system, self.point)
@@ -308,12 +928,112 @@ class Sector(object):
         return self.__unicode__()
 
     def sector_id(self):
-        s = SYSTEM_ID[self.system]
-        (x, y) = sector_py2vo(self.point.x, self.point.y)
-        return (s - 2) * 256 + (y - 1) * 16 + x
+        return self._id
 
     def __hash__(self):
-        return self.sector_id()
+        return self._id
+
+
+_SECTORS = dict()
+_SECTOR_IDS = [None] * (len(SYSTEM_ID) * 256 + 1)
+
+for system in SYSTEM_ID:
+    _SECTORS[system] = [Sector._create(system, point) for point in _POINTS]
+    for sector in _SECTORS[system]:
+        _SECTOR_IDS[sector.sector_id()] = sector
+
+
+class SectorSet(object):
+    """A set of Sectors stored as one 256-bit bitboard per system (bit
+    `y * 16 + x` of a system's mask is set if that sector is in the set), so
+    that the sectors in a single system can be read as a mask in constant
+    time, and union and difference work a system at a time.
+    """
+    def __init__(self, sectors=()):
+        self.masks = dict()
+        for sector in sectors:
+            self.add(sector)
+
+    @classmethod
+    def from_masks(cls, masks):
+        """Creates a SectorSet from a dictionary of system => bitboard.
+        """
+        sectors = cls()
+        sectors.masks = dict((s, m) for s, m in masks.iteritems() if m)
+        return sectors
+
+    @classmethod
+    def coerce(cls, sectors):
+        """Returns `sectors` if it is already a SectorSet, otherwise a new
+        SectorSet of the Sectors in iterable `sectors`.
+        """
+        if isinstance(sectors, cls):
+            return sectors
+        return cls(sectors)
+
+    def add(self, sector):
+        bit = 1 << (sector.point.y * 16 + sector.point.x)
+        self.masks[sector.system] = self.masks.get(sector.system, 0) | bit
+
+    def discard(self, sector):
+        mask = self.masks.get(sector.system, 0) & ~(1 << (sector.point.y * 16 + sector.point.x))
+        if mask:
+            self.masks[sector.system] = mask
+        else:
+            self.masks.pop(sector.system, None)
+
+    def system_mask(self, system):
+        """Returns the bitboard of the sectors in the set within `system`.
+        """
+        return self.masks.get(system, 0)
+
+    def systems(self):
+        """Returns the set of systems with at least one sector in the set.
+        """
+        return set(self.masks)
+
+    def __contains__(self, sector):
+        return bool(self.masks.get(sector.system, 0) >> (sector.point.y * 16 + sector.point.x) & 1)
+
+    def __iter__(self):
+        for system in sorted(self.masks):
+            sectors = _SECTORS[system]
+            mask = self.masks[system]
+            while mask:
+                bit = mask & -mask
+                mask ^= bit
+                yield sectors[bit.bit_length() - 1]
+
+    def __len__(self):
+        return sum(bin(mask).count('1') for mask in self.masks.itervalues())
+
+    def __nonzero__(self):
+        return bool(self.masks)
+
+    def __eq__(self, other):
+        return self.masks == SectorSet.coerce(other).masks
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __or__(self, other):
+        masks = dict(self.masks)
+        for system, mask in SectorSet.coerce(other).masks.iteritems():
+            masks[system] = masks.get(system, 0) | mask
+        return SectorSet.from_masks(masks)
+
+    def __and__(self, other):
+        other = SectorSet.coerce(other)
+        masks = dict((s, m & other.system_mask(s)) for s, m in self.masks.iteritems())
+        return SectorSet.from_masks(masks)
+
+    def __sub__(self, other):
+        other = SectorSet.coerce(other)
+        masks = dict((s, m & ~other.system_mask(s)) for s, m in self.masks.iteritems())
+        return SectorSet.from_masks(masks)
+
+    def __repr__(self):
+        return 'SectorSet(%r)' % list(self)
 
 
 def draw(size, highlights=None, obstacles=None):
@@ -351,77 +1071,332 @@ def draw(size, highlights=None, obstacles=None):
     print "\n"
 
 
-def jump_plans(start, end, route=None, acc=None, seen=None):
-    """Finds all possible series of system jumps between system `start` and
-    `end`, both of which must be short system names.
+class JumpGraph(object):
+    """An index over a graph of system jumps (see `info.JUMPS`). The number of
+    jumps and the next hop between every pair of systems are computed once,
+    using a breadth-first search from each system, so that shortest jump plans
+    can be read back without searching the graph again.
     """
-    if route is None:
-        route = []
+    def __init__(self, jumps):
+        self.jumps = jumps
+        self.distances = dict()
+        self.next_hops = dict()
+        self.plans = dict()
+        self.vectors = dict()
+
+        # Edges are followed backwards from each destination, so that the
+        # search tree rooted at `end` yields the next hop toward `end` from
+        # every other system.
+        reverse = dict((system, set()) for system in jumps)
+        for system, targets in jumps.iteritems():
+            for target in targets:
+                reverse[target].add(system)
+
+        for end in jumps:
+            distance = {end: 0}
+            next_hop = {end: None}
+            queue = deque([end])
+
+            while queue:
+                current = queue.popleft()
+                for system in sorted(reverse[current]):
+                    if system not in distance:
+                        distance[system] = distance[current] + 1
+                        next_hop[system] = current
+                        queue.append(system)
+
+            self.distances[end] = distance
+            self.next_hops[end] = next_hop
+
+        for end in jumps:
+            for start in self.distances[end]:
+                plan = [start]
+                while plan[-1] != end:
+                    plan.append(self.next_hops[end][plan[-1]])
+                self.plans[(start, end)] = tuple(plan)
+
+    def distance(self, start, end):
+        """Returns the number of jumps between systems `start` and `end`, or
+        None if `end` cannot be reached from `start`.
+        """
+        return self.distances[end].get(start)
 
-    if acc is None:
-        acc = []
+    def distances_from(self, start):
+        """Returns a dictionary of system => the number of jumps to it from
+        `start`, for every system that can be reached from `start`.
+        """
+        vector = self.vectors.get(start)
+        if vector is None:
+            vector = dict((end, d[start]) for end, d in self.distances.iteritems() if start in d)
+            self.vectors[start] = vector
+        return vector
+
+    def next_hop(self, start, end):
+        """Returns the next system to jump to from `start` on a shortest plan
+        to `end`, or None if `start` is `end` or `end` is unreachable.
+        """
+        return self.next_hops[end].get(start)
 
-    if seen is None:
-        seen = set()
+    def plan(self, start, end):
+        """Returns a shortest series of systems (as a tuple) between `start`
+        and `end`, or None if `end` cannot be reached from `start`.
+        """
+        return self.plans.get((start, end))
 
-    if start not in seen:
-        seen.add(start)
-        rt = copy(route)
-        rt.append(start)
+    def plans_between(self, start, end):
+        """Generates every shortest series of systems between `start` and
+        `end`. Each step is restricted to systems one jump closer to `end`, so
+        no partial plan is ever abandoned.
+        """
+        distance = self.distances[end]
+        if start not in distance:
+            return
 
-        if start == end:
-            acc.append(rt)
-        else:
-            for system in JUMPS[start]:
-                jump_plans(system, end, copy(rt), acc, copy(seen))
+        stack = [(start,)]
+        while stack:
+            plan = stack.pop()
+            current = plan[-1]
+
+            if current == end:
+                yield list(plan)
+                continue
+
+            for system in sorted(self.jumps[current], reverse=True):
+                if distance.get(system) == distance[current] - 1:
+                    stack.append(plan + (system,))
+
+    def search(self, start, end, blocked_systems=(), blocked_jumps=()):
+        """Returns a shortest series of systems between `start` and `end` that
+        passes through none of `blocked_systems` and uses none of the
+        (from, to) jumps in `blocked_jumps`, or None if there is none.
+        """
+        if start in blocked_systems:
+            return None
+
+        parents = {start: None}
+        queue = deque([start])
+
+        while queue:
+            current = queue.popleft()
+            if current == end:
+                plan = []
+                while current is not None:
+                    plan.append(current)
+                    current = parents[current]
+                plan.reverse()
+                return tuple(plan)
+
+            for system in sorted(self.jumps[current]):
+                if system in parents or system in blocked_systems:
+                    continue
+
+                if (current, system) in blocked_jumps:
+                    continue
 
-    return acc
+                parents[system] = current
+                queue.append(system)
+
+    def iter_plans(self, start, end):
+        """Generates every series of systems between `start` and `end` that
+        visits no system twice, in order of increasing length, using Yen's
+        k-shortest paths algorithm. Plans are only found as they are
+        requested, so callers that stop early do not pay for the rest.
+        """
+        plan = self.plan(start, end)
+        if plan is None:
+            return
+
+        found = [plan]
+        seen = set(found)
+        candidates = []
+
+        while True:
+            yield list(plan)
+
+            for i in xrange(0, len(plan) - 1):
+                root = plan[:i + 1]
+                spur = plan[i]
+
+                blocked_jumps = set()
+                for previous in found:
+                    if previous[:i + 1] == root:
+                        blocked_jumps.add((previous[i], previous[i + 1]))
+
+                tail = self.search(spur, end, root[:-1], blocked_jumps)
+                if tail is None:
+                    continue
+
+                candidate = root[:-1] + tail
+                if candidate not in seen:
+                    seen.add(candidate)
+                    heapq.heappush(candidates, (len(candidate), candidate))
+
+            if not candidates:
+                return
+
+            _, plan = heapq.heappop(candidates)
+            found.append(plan)
+
+
+"""
+Index of shortest jump plans between all systems in `info.JUMPS`.
+"""
+JUMP_GRAPH = JumpGraph(JUMPS)
+
+
+def jump_distance(start, end):
+    """Returns the number of jumps between system `start` and `end`, both of
+    which must be short system names.
+    """
+    return JUMP_GRAPH.distance(start, end)
+
+
+def jump_distances(start):
+    """Returns a dictionary of short system name => the number of jumps to it
+    from system `start`, for every system that can be reached from `start`.
+    """
+    return JUMP_GRAPH.distances_from(start)
+
+
+def iter_jump_plans(start, end):
+    """Generates every series of system jumps between system `start` and
+    `end`, shortest first. Both must be short system names.
+    """
+    return JUMP_GRAPH.iter_plans(start, end)
+
+
+def jump_plans(start, end):
+    """Finds all possible series of system jumps between system `start` and
+    `end`, both of which must be short system names.
+    """
+    return list(iter_jump_plans(start, end))
+
+
+def shortest_jump_plan(start, end):
+    """Returns a single shortest series of system jumps between system `start`
+    and `end`, both of which must be short system names.
+    """
+    return JUMP_GRAPH.plan(start, end)
 
 
 def shortest_jump_plans(start, end):
     """Finds the shortest series of system jumps between system `start` and
     `end`, both of which must be short system names.
     """
-    routes = jump_plans(start, end)
-    shortest = min(len(r) for r in routes)
-    return [r for r in routes if len(r) == shortest]
+    return list(JUMP_GRAPH.plans_between(start, end))
+
+
+class TransitTable(object):
+    """Routes between every ordered pair of wormhole sectors in a system for
+    one set of hazards, so that crossing a system on the way to another is a
+    lookup. As in `plan_route`, the two wormholes of each pair are never
+    treated as hazards on their own route.
+    """
+    def __init__(self, system, avoid, obstacles, size=16):
+        self.system = system
+        self.avoid = avoid
+        self.obstacles = obstacles
+        self.routes = dict()
+
+        wormholes = sorted(Point(x, y) for (x, y) in WORMHOLE[system].itervalues())
+        for start in wormholes:
+            for end in wormholes:
+                if start == end:
+                    continue
+
+                a = start.y * size + start.x
+                b = end.y * size + end.x
+                exempt = ~(1 << a | 1 << b)
+                graph = visibility_graph(size, avoid & exempt, obstacles & exempt)
+
+                route = graph.search(a, b)
+                if route is not None:
+                    route = [Point(i % size, i // size) for i in route]
+                self.routes[(start, end)] = route
+
+    def route(self, start, end):
+        """Returns the list of Points between wormhole Points `start` and
+        `end`, or None if there is no clear route.
+        """
+        return self.routes[(start, end)]
+
+
+"""
+Maximum number of TransitTables kept by `transit_table`: two hazard sets
+(with and without obstacles) for each system.
+"""
+TRANSIT_TABLE_CACHE_SIZE = 2 * len(WORMHOLE)
+
+_TRANSIT_TABLES = OrderedDict()
+_TRANSIT_TABLES_LOCK = threading.Lock()
+
+
+def transit_table(system, avoid, obstacles):
+    """Returns the TransitTable for `system` with the `avoid` and `obstacles`
+    bitboards, building it only if that system's hazards have changed since
+    it was last requested.
+    """
+    key = (system, avoid, obstacles)
+    with _TRANSIT_TABLES_LOCK:
+        table = _TRANSIT_TABLES.pop(key, None)
+        if table is not None:
+            _TRANSIT_TABLES[key] = table
+            return table
+
+    table = TransitTable(system, avoid, obstacles)
 
+    with _TRANSIT_TABLES_LOCK:
+        _TRANSIT_TABLES[key] = table
+        while len(_TRANSIT_TABLES) > TRANSIT_TABLE_CACHE_SIZE:
+            _TRANSIT_TABLES.popitem(last=False)
 
-def plan_route(start, end, avoid=None, obstacles=None):
+    return table
+
+
+def plan_route(start, end, avoid=None, obstacles=None, budget=None):
     """Generates an optimal series of navigation waypoints between sectors
-    `start` and `end`, avoiding Sectors in set `avoid`.
+    `start` and `end`, avoiding Sectors in set `avoid`. Series of system jumps
+    are tried shortest first; if any system on a series cannot be crossed, the
+    next series is tried. Returns an empty list if no route exists. With a
+    Budget, each system crossing is planned as `Path.calculate_path` does,
+    and no further series are tried once it runs out.
     """
-    if avoid is None:
-        avoid = set()
+    avoid = SectorSet.coerce(avoid or ())
+    obstacles = SectorSet.coerce(obstacles or ())
 
-    if obstacles is None:
-        obstacles = set()
+    # Results for each system crossing, shared between jump plans since
+    # alternative plans often cross the same systems.
+    legs = dict()
+
+    def _route(system, start_point, end_point, transit=False):
+        key = (system, start_point, end_point)
+        if key in legs:
+            return legs[key]
 
-    systems = shortest_jump_plans(start.system, end.system)[0]
-    routes = []
+        avoid_mask = avoid.system_mask(system)
+        obstacle_mask = obstacles.system_mask(system)
+
+        if transit:
+            table = transit_table(system, avoid_mask, obstacle_mask)
+            legs[key] = table.route(start_point, end_point)
+            return legs[key]
 
-    def _route(system, start_point, end_point):
         path = Path(16, start_point, end_point)
-        if avoid is not None:
-            for sector in avoid:
-                if sector.system == system:
-                    if sector.point in [start_point, end_point]:
-                        continue
-                    path.add_avoidance(sector.point)
-
-            for sector in obstacles:
-                if sector.system == system:
-                    if sector.point in [start_point, end_point]:
-                        continue
-                    path.add_obstacle(sector.point)
-
-        return path.calculate_path()
-
-    if len(systems) == 1:
-        route = _route(systems[0], start.point, end.point)
-        if route:
-            return [Sector(systems[0], w) for w in route]
-    else:
+        exempt = ~(1 << path.grid.index(start_point) | 1 << path.grid.index(end_point))
+        path.grid.avoid = avoid_mask & exempt
+        path.grid.obstacles = obstacle_mask & exempt
+
+        legs[key] = path.calculate_path(budget=budget)
+        return legs[key]
+
+    def _plan(systems):
+        if len(systems) == 1:
+            route = _route(systems[0], start.point, end.point)
+            if route:
+                return [Sector(systems[0], w) for w in route]
+            return None
+
+        routes = []
         for i in xrange(0, len(systems)):
             current_system = systems[i]
 
@@ -441,32 +1416,244 @@ def plan_route(start, end, avoid=None, obstacles=None):
             else:
                 end_point = Point(*WORMHOLE[current_system][systems[i + 1]])
 
-            waypoints = _route(current_system, start_point, end_point)
+            # Systems crossed between two wormholes are looked up rather
+            # than routed.
+            transit = 0 < i < len(systems) - 1
+            waypoints = _route(current_system, start_point, end_point, transit)
+            if waypoints is None:
+                return None
+
             routes.extend([Sector(current_system, w) for w in waypoints])
 
-    return routes
+        return routes
+
+    for systems in iter_jump_plans(start.system, end.system):
+        routes = _plan(systems)
+        if routes is not None:
+            return routes
+
+        if budget is not None and budget.exhausted():
+            budget.give_up()
+            break
+
+    return []
 
 
-def navigate(waypoints, avoid=None, obstacles=None):
+def _wormhole_links(size):
+    """Returns a dictionary of system => {bit index => [(system, bit index)]}
+    linking each wormhole sector to the sector it arrives at in the next
+    system.
+    """
+    links = dict()
+    for system, targets in WORMHOLE.iteritems():
+        links[system] = dict()
+        for target, (x, y) in targets.iteritems():
+            tx, ty = WORMHOLE[target][system]
+            links[system].setdefault(y * size + x, []).append((target, ty * size + tx))
+    return links
+
+
+_WORMHOLE_LINKS = _wormhole_links(16)
+
+
+def plan_universe_route(start, end, avoid=None, obstacles=None, budget=None):
+    """Generates a series of navigation waypoints between sectors `start` and
+    `end` using an A* search over a single graph of the sectors of every
+    system, linked by clear straight lines within a system and by wormhole
+    jumps between systems. Unlike `plan_route`, the series of systems is not
+    fixed in advance, so the route with the fewest steps overall (then the
+    shortest distance) is found. Returns an empty list if no route exists.
+
+    Within a system, only the route's end points and the sectors arrived at
+    by jumps are expanded; the steps from them to the end or to a wormhole,
+    which must then be jumped through, are found with a VisibilityGraph
+    search, which is exact for the same ordering. As in `plan_route`, only
+    the two ends of each such leg are exempt from hazards.
+
+    With a Budget, the search is given half of it: every node taken from
+    the queue is spent from that half along with the searches between them.
+    If it runs out, a route is planned by `plan_route` on what remains, and
+    returned unless the route to the end found so far has no more steps.
+    """
+    avoid = SectorSet.coerce(avoid or ())
+    obstacles = SectorSet.coerce(obstacles or ())
+
+    size = 16
+    links = _WORMHOLE_LINKS
+
+    def _index(sector):
+        return sector.point.y * size + sector.point.x
+
+    source = (start.system, _index(start))
+    target = (end.system, _index(end))
+
+    graphs = dict()
+
+    # The two ends of each leg within a system are never treated as hazards
+    # on that leg, just as plan_route never avoids the ends of each system
+    # crossing; any other wormhole a leg passes through may still be avoided.
+    def _graph(system, a, b):
+        key = (system, a, b)
+        if key not in graphs:
+            exempt = ~(1 << a | 1 << b)
+            graphs[key] = visibility_graph(size,
+                                           avoid.system_mask(system) & exempt,
+                                           obstacles.system_mask(system) & exempt)
+        return graphs[key]
+
+    def _key_sectors(system):
+        indexes = set(links[system])
+        if system == start.system:
+            indexes.add(source[1])
+        if system == end.system:
+            indexes.add(target[1])
+        return sorted(indexes)
+
+    # Fewest steps still needed from a sector: every remaining system jump
+    # takes a step, as does every crossing of the systems in between, and
+    # one more step is needed to reach a wormhole leading closer to the end
+    # (or the end itself) from anywhere else.
+    def _heuristic(node):
+        system, index = node
+        jumps = jump_distance(system, end.system)
+        if jumps == 0:
+            return 0 if node == target else 1
+
+        for jump in links[system].get(index, ()):
+            if jump_distance(jump[0], end.system) == jumps - 1:
+                return 2 * jumps - 1
+        return 2 * jumps
+
+    def _sectors(system, indexes):
+        return [Sector(system, Point(i % size, i // size)) for i in indexes]
+
+    # A clear straight line needs no search, or budget.
+    if start.system == end.system:
+        if _graph(start.system, source[1], target[1]).neighbours(source[1]) >> target[1] & 1:
+            return [start, end]
+        if source == target:
+            return []
+
+    search = None
+    if budget is not None:
+        search = budget.split(2)
+
+    best = {source: (0, 0.0)}
+    parents = {source: None}
+    queue = [(_heuristic(source), 0.0, 0, source)]
+
+    def _route_to(node):
+        legs = []
+        while parents[node] is not None:
+            node, leg = parents[node]
+            legs.append(leg)
+        legs.reverse()
+
+        route = [start]
+        for leg in legs:
+            route.extend(leg)
+        return route
+
+    def _fallback():
+        budget.give_up()
+        found = []
+        if target in parents:
+            found = _route_to(target)
+
+        route = plan_route(start, end, avoid, obstacles, budget.split(1))
+
+        # plan_route leaves out a start on a wormhole.
+        if route and route[0] != start:
+            route.insert(0, start)
+
+        if found and (not route or len(found) <= len(route)):
+            return found
+        return route
+
+    while queue:
+        _, distance, steps, node = heapq.heappop(queue)
+        if node == target:
+            return _route_to(node)
+
+        if (steps, distance) > best[node]:
+            continue
+
+        if search is not None:
+            if search.exhausted():
+                return _fallback()
+            search.spend()
+
+        system, index = node
+
+        successors = []
+        for jump in links[system].get(index, ()):
+            successors.append((jump, 1, 0.0, _sectors(jump[0], [jump[1]])))
+
+        for other in _key_sectors(system):
+            if other == index:
+                continue
+
+            graph = _graph(system, index, other)
+            indexes = graph.search(index, other, search)
+            if indexes is None:
+                continue
+
+            length = sum(graph.distance(a, b) for a, b in zip(indexes, indexes[1:]))
+            leg = _sectors(system, indexes[1:])
+            if other == target[1] and system == end.system:
+                successors.append(((system, other), len(indexes) - 1, length, leg))
+
+            # A wormhole is only a leg's end if it is jumped from, since it
+            # may be a hazard to anything else passing through it.
+            for jump in links[system].get(other, ()):
+                successors.append((jump, len(indexes), length, leg + _sectors(jump[0], [jump[1]])))
+
+        for successor, step_cost, length, leg in successors:
+            cost = (steps + step_cost, distance + length)
+            if successor not in best or cost < best[successor]:
+                best[successor] = cost
+                parents[successor] = (node, leg)
+                estimate = cost[0] + _heuristic(successor)
+                heapq.heappush(queue, (estimate, cost[1], cost[0], successor))
+
+    # Searches between key sectors cut short by the budget may have left the
+    # end unreached.
+    if search is not None and search.exhausted():
+        return _fallback()
+    return []
+
+
+def navigate(waypoints, avoid=None, obstacles=None, router=plan_route, budget=None):
     """Generates a series of safe jumps between `waypoints`, avoiding crossing
     any sectors in set `avoid` and refusing to use sectors in set `obstacles`
-    as waypoints.
-    """
-    if avoid is None:
-        avoid = set()
+    as waypoints; both may be SectorSets or any iterable of Sectors. Each leg
+    is planned with `router` (`plan_route` or `plan_universe_route`). Returns
+    an empty list if any leg cannot be routed.
 
-    if obstacles is None:
-        obstacles = set()
+    A Budget is shared between the legs: each leg is given an equal share of
+    what the legs before it left unused.
+    """
+    avoid = SectorSet.coerce(avoid or ())
+    obstacles = SectorSet.coerce(obstacles or ())
 
     start = waypoints[0]
     plan = []
 
     # Ensure that avoid includes none of the waypoints
-    avoid = avoid - set(waypoints)
-    obstacles = obstacles - set(waypoints)
+    exempt = SectorSet(waypoints)
+    avoid = avoid - exempt
+    obstacles = obstacles - exempt
+
+    ends = waypoints[1:]
+    for i, end in enumerate(ends):
+        leg_budget = None
+        if budget is not None:
+            leg_budget = budget.split(len(ends) - i)
+
+        route = router(start, end, avoid, obstacles, leg_budget)
+        if not route:
+            return []
 
-    for end in waypoints[1:]:
-        route = plan_route(start, end, avoid, obstacles)
         plan.extend(route[1:])
         start = end
 